@@ -1,10 +1,11 @@
 import sys
 import os
-import xml.etree.ElementTree as ET
-from PyQt5.QtCore import QFile, QTextStream, Qt
-from PyQt5.QtWidgets import QApplication, QMainWindow, QTableWidget, QTableWidgetItem, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QLineEdit, QPushButton, QTextEdit, QTabWidget, QFileDialog, QAction, QMessageBox, QScrollArea
+import time
+from PyQt5.QtCore import QFile, QTextStream, Qt, QTimer, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QBrush, QColor
+from PyQt5.QtWidgets import QApplication, QMainWindow, QComboBox, QTableView, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QLineEdit, QPushButton, QTextEdit, QTabWidget, QFileDialog, QAction, QMessageBox, QScrollArea
 import numpy as np
-from scipy.optimize import curve_fit
+from scipy.optimize import linear_sum_assignment
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
@@ -12,6 +13,15 @@ import csv
 import json
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import math
+from collections import OrderedDict
+from fit_io import FitCache, FitWatcher, fit_to_table, find_angle_files, find_angle_runs, merge_fit_rows, add_fit_rows
+from calibration import stack_ragged, polynomial_derivative, fit_effective_variance, fit_huber, fit_ransac, fit_joint, evaluate_polynomial, polynomial_band, calibration_key, resample_calibration
+from levels import load_level_library, identify_levels
+from kinematics import parse_masses, kinematics_table, two_body_in_target, rigidity, rigidity_derivative, excitation_from_rigidity
+from stopping import load_stopping_table
+from events import EVENT_EXTENSIONS, histogram_angles
+from spectra import SPECTRUM_EXTENSIONS, FWHM_PER_SIGMA, PEAK_WIDTH, Spectrum, fit_spectra, search_spectra
+from session_io import SessionJournal, write_session, is_session_file, read_session_header, read_session_tab
 
 AVAGADRO_NUM = 6.023E23
 CM_TO_BARN = 1.0E-24 # converts cm^2 to barns
@@ -20,186 +30,221 @@ ELEMENTARY_CHARGE = 1.60E-19 # in C
 D_OMEGA_= 0.00463 # slit settings in steradians
 Z = 1 # Number of protons in beam
 
-def get_next_blank_row(table):
-    # Get the total number of rows in the table
-    total_rows = table.rowCount()
-
-    # Loop through each row
-    for i in range(total_rows):
-        # Check if every cell in the row is empty
-        row_empty = all(table.item(i, j) is None for j in range(table.columnCount()))
-
-        # If the row is empty, return its index
-        if row_empty:
-            return int(i)
-
-    # If no empty row is found, return the next row index
-    return int(total_rows)
-
-def get_table_data(table):
-    data = []
-    for i in range(table.rowCount()):
-        row = []
-        for j in range(table.columnCount()):
-            item = table.item(i, j)
-            if item is not None:
-                if len(item.text()) == 0:
-                    row.append(np.nan)
-                else:
-                    row.append(float(item.text()))
-            else:
-                row.append(np.nan)
-        data.append(row)
-
-    # Convert data to numpy array
-    data = np.array(data)
-    return data
+def get_next_blank_row(model):
+    # Index of the first row where every cell is empty, or the next row index if there is none
+    empty = np.nonzero(np.isnan(model.array).all(axis=1))[0]
+    if len(empty):
+        return int(empty[0])
+    return int(model.rowCount())
+
+def get_table_data(model):
+    # The model already holds the table as a float array (nan = empty cell)
+    return model.array.copy()
+
+def format_cell(value):
+    # Shortest text that reads back as the same float, without a trailing '.0' (1.0 -> '1')
+    text = repr(float(value))
+    return text[:-2] if text.endswith('.0') else text
+
+def fill_table(model, data):
+    # Replaces the table contents with a 2D array in one model reset
+    model.set_array(data)
+
+def update_table(model, data):
+    # Only the rows that differ from what the table already holds are signalled, returns them
+    return model.update_array(data)
+
+def match_states(reference, energies, tolerance):
+    # Optimal one-to-one assignment of reference state energies to the rows of one angle tab:
+    # as many states as possible are matched within tolerance [keV], with the smallest total |dE|.
+    # Returns the matched row of every reference state, -1 where there is none
+    reference = np.asarray(reference, dtype=np.float64)
+    energies = np.asarray(energies, dtype=np.float64)
+    rows = np.full(len(reference), -1)
+
+    # sorted index over the tab energies, each state only looks at its tolerance window
+    valid = np.nonzero(~np.isnan(energies))[0]
+    order = valid[np.argsort(energies[valid], kind='stable')]
+    sorted_energies = energies[order]
+    lo = np.searchsorted(sorted_energies, reference - tolerance, side='left')
+    hi = np.searchsorted(sorted_energies, reference + tolerance, side='right')
+    states = np.nonzero(hi > lo)[0]
+    if len(states) == 0:
+        return rows
+
+    # only the candidate rows enter the assignment, infeasible pairs get a cost above any feasible set
+    first, last = lo[states].min(), hi[states].max()
+    cost = np.abs(reference[states][:, None] - sorted_energies[None, first:last])
+    feasible = cost <= tolerance
+    cost[~feasible] = (tolerance + 1.0) * (len(states) + 1)
+    state_index, row_index = linear_sum_assignment(cost)
+    matched = feasible[state_index, row_index]
+    rows[states[state_index[matched]]] = order[first + row_index[matched]]
+    return rows
+
+def match_states_across(reference, energy_columns, tolerance):
+    # match_states for every angle tab at once, returns a (states, angles) array of row indices
+    return np.column_stack([match_states(reference, energies, tolerance) for energies in energy_columns])
 
 def cross_section_calculation(BCI_hit, BCI_scale, targetThickness, molarMass, volume, volume_err): #func used to convert mass in ug/cm --> 1/barn
+    # Works on scalars as well as whole arrays, e.g. BCI hits/scales of shape (angles,) broadcast
+    # against volumes of shape (states, angles). A missing state (nan volume) gives nan, so plots
+    # skip it, and a zero volume gives 0 uncertainty, full float64 precision is kept
+
+    BCI_hit = np.asarray(BCI_hit, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    volume_err = np.asarray(volume_err, dtype=np.float64)
 
     rho_t = (targetThickness * CM_TO_BARN * AVAGADRO_NUM)/(molarMass)
-    Q_beam = (BCI_hit * 1E-9 * BCI_scale)/(SAMPLING_RATE)
+    Q_beam = (BCI_hit * 1E-9 * np.asarray(BCI_scale, dtype=np.float64))/(SAMPLING_RATE)
     N_beam = Q_beam / ELEMENTARY_CHARGE
     dsigma_domega = (volume * 1000)/(N_beam * rho_t * D_OMEGA_)  # cross-sec in mb/sr
 
     err_BCI = 0.15 * BCI_hit
-    if volume == 0.0:
-        deltaX = 0.0
-    else:
+    with np.errstate(divide='ignore', invalid='ignore'):
         deltaX = np.sqrt( (volume_err/volume)**2 + (err_BCI/BCI_hit)**2 ) * dsigma_domega
-    
-    dsigma_domega = round(dsigma_domega, 7)
-    deltaX = round(deltaX, 7)
-    
-    return dsigma_domega, deltaX
+    deltaX = np.where(volume == 0.0, 0.0, deltaX)
 
-def general_xml(file,name):
-    #Wrote by Bryan Kelly to extract the xml format fit file from HDTV to a easily readable table if wanted
-    mytree = ET.parse(file)
-    myroot = mytree.getroot()
- 
-    uncal_fit_list = []
-    uncal_fit_err_list = []
-    uncal_width_list = []
-    uncal_width_err_list = []
-    uncal_volume_list = []
-    uncal_volume_err_list = []
-
-    cal_fit_list = []
-    cal_fit_err_list = []
-    cal_width_list = []
-    cal_width_err_list = []
-    cal_volume_list = []
-    cal_volume_err_list = []
-
-    for fit in myroot:
-        for i in fit:
-            if i.tag == 'peak':
-                for child in i.iter():
-                    if child.tag == 'uncal':
-                        for j in child.iter():
-                            if j.tag == 'pos':
-                                for newchild in j.iter():
-                                    if newchild.tag == 'value':
-                                        fit_value = newchild.text
-                                        uncal_fit_list.append(round(float(fit_value), 4))
-                                    elif newchild.tag == 'error':
-                                        fit_err = newchild.text
-                                        uncal_fit_err_list.append(round(float(fit_err),4))
-                            elif j.tag == 'vol':
-                                for newchild in j.iter():
-                                    if newchild.tag == 'value':
-                                        vol_value = newchild.text
-                                        uncal_volume_list.append(round(float(vol_value),4))
-                                    elif newchild.tag == 'error':
-                                        vol_err = newchild.text
-                                        uncal_volume_err_list.append(round(float(vol_err),4))
-                            elif j.tag == 'width':
-                                for newchild in j.iter():
-                                    if newchild.tag == 'value':
-                                        width_value = newchild.text
-                                        uncal_width_list.append(round(float(width_value),4))
-                                    elif newchild.tag == 'error':
-                                        width_err = newchild.text
-                                        uncal_width_err_list.append(round(float(width_err),4))
-
-                    #gets the calibrated data information                
-                    if child.tag == 'cal':
-                        for j in child.iter():
-                            if j.tag == 'pos':
-                                for newchild in j.iter():
-                                    if newchild.tag == 'value':
-                                        fit_value = newchild.text
-                                        cal_fit_list.append(round(float(fit_value), 4))
-                                    elif newchild.tag == 'error':
-                                        fit_err = newchild.text
-                                        cal_fit_err_list.append(round(float(fit_err),4))
-                            elif j.tag == 'vol':
-                                for newchild in j.iter():
-                                    if newchild.tag == 'value':
-                                        vol_value = newchild.text
-                                        cal_volume_list.append(round(float(vol_value),4))
-                                    elif newchild.tag == 'error':
-                                        vol_err = newchild.text
-                                        cal_volume_err_list.append(round(float(vol_err),4))
-                            elif j.tag == 'width':
-                                for newchild in j.iter():
-                                    if newchild.tag == 'value':
-                                        width_value = newchild.text
-                                        cal_width_list.append(abs(round(float(width_value),4)))
-                                    elif newchild.tag == 'error':
-                                        width_err = newchild.text
-                                        cal_width_err_list.append(round(float(width_err),4))
-    
-    # calibrated data handling
-    cal_energy = []
-    cal_energy_err = []
-    cal_use = []
-    for _ in range(len(cal_fit_list)):
-        cal_use.append(np.nan)
-        cal_energy.append(np.nan)
-        cal_energy_err.append(np.nan)
-
-    #csv file
-    fname = name.split('.')[0]
-    storefile = f'{fname}.csv'
-
-    uncal_list = list(zip(cal_use, cal_energy, cal_energy_err, uncal_fit_list, uncal_fit_err_list, uncal_width_list, uncal_width_err_list, uncal_volume_list, uncal_volume_err_list))
-    uncal_list.sort(key=lambda x:x[3], reverse=True)
-    cal_list = list(zip(cal_use, cal_energy, cal_energy_err, cal_fit_list, cal_fit_err_list, cal_width_list, cal_width_err_list, cal_volume_list, cal_volume_err_list))
-    cal_list.sort(key=lambda x:x[3])
-
-    cal_flag = True
-    if (uncal_fit_list[0] == cal_fit_list[0]):
-        cal_flag = False
-
-        with open(storefile, 'w') as f:
-            writer = csv.writer(f, delimiter=',')
-            for row in uncal_list:
-                writer.writerow(row)        
-        return storefile, cal_flag
-    else:
-        with open(storefile, 'w') as f:
-            writer = csv.writer(f, delimiter=',')
-            for row in cal_list:
-                writer.writerow(row)        
-        return storefile, cal_flag
+    missing = np.isnan(volume)
+    dsigma_domega = np.where(missing, np.nan, dsigma_domega)
+    deltaX = np.where(missing, np.nan, np.where(np.isnan(volume_err), 0.0, deltaX))
+    return dsigma_domega, deltaX
 
 def save_data(data, name):
     with open(name + '.csv', 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerows(data)
 
-def load_data(name):
-    with open(name, 'r') as csvfile:
-        reader = csv.reader(csvfile)
-        return [row for row in reader]
-
-def linear_func(x, m, c):
-    return m*x + c
-
-def poly2_func(x, a, b, c):
-    return a*x*x + b*x + c 
+def calibration_results(pos, params, pcov, chi2_ndf, sigma, outliers):
+    # One dict (see FIT_KEYS) per stacked fit. The 1 sigma bands on the plotting grid and at the
+    # data points come from the covariance
+    band = polynomial_band(params, pcov, CALIBRATION_RANGE)
+    point_band = polynomial_band(params, pcov, pos)
+    return [dict(zip(FIT_KEYS, values)) for values in zip(params, pcov, chi2_ndf, sigma, outliers, band, point_band)]
+
+def save_calibration(name, pos, linear, poly):
+    # Parameters with their covariance and the 1 sigma bands at the data points and on CALIBRATION_RANGE
+    with open(name + '_calibration.txt', 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        for label, fit in (('Linear', linear), ('Polynomial', poly)):
+            writer.writerow([f"# {label}", 'chi2/ndf', fit['chi2_ndf']])
+            writer.writerow(['# params'] + list(fit['params']))
+            for row in fit['pcov']:
+                writer.writerow(['# cov'] + list(row))
+        writer.writerow(['# Position', 'Linear', 'Linear 1 sigma', 'Polynomial', 'Polynomial 1 sigma'])
+        for x, linear_band, poly_band in ((pos, linear['point_band'], poly['point_band']), (CALIBRATION_RANGE, linear['band'], poly['band'])):
+            writer.writerows(zip(x, evaluate_polynomial(linear['params'], x), linear_band[:len(x)],
+                                 evaluate_polynomial(poly['params'], x), poly_band[:len(x)]))
+
+class ArrayTableModel(QAbstractTableModel):
+    # Table model that stores its cells in a 2D float64 array (nan = empty cell). Computations
+    # read self.array directly, bulk writes go through set_array/update_array/set_values
+    def __init__(self, rows, headers, parent=None):
+        super().__init__(parent)
+        self.headers = list(headers)
+        self.array = np.full((rows, len(self.headers)), np.nan)
+        self.flagged = np.zeros(rows, dtype=bool) # rows highlighted as outliers, see set_flagged
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.array.shape[0]
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.array.shape[1]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            value = self.array[index.row(), index.column()]
+            return '' if np.isnan(value) else format_cell(value)
+        if self.flagged[index.row()]:
+            if role == Qt.BackgroundRole:
+                return QBrush(QColor(255, 200, 200))
+            if role == Qt.ToolTipRole:
+                return "Rejected as an outlier by the robust calibration"
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole:
+            return False
+        text = str(value).strip()
+        try:
+            value = float(text) if text else np.nan
+        except ValueError:
+            return False
+        self.array[index.row(), index.column()] = value
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        return True
+
+    def flags(self, index):
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def insertRows(self, row, count, parent=QModelIndex()):
+        self.beginInsertRows(parent, row, row + count - 1)
+        self.array = np.concatenate([self.array[:row], np.full((count, self.array.shape[1]), np.nan), self.array[row:]])
+        self.flagged = np.concatenate([self.flagged[:row], np.zeros(count, dtype=bool), self.flagged[row:]])
+        self.endInsertRows()
+        return True
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        self.beginRemoveRows(parent, row, row + count - 1)
+        self.array = np.delete(self.array, np.s_[row:row + count], axis=0)
+        self.flagged = np.delete(self.flagged, np.s_[row:row + count])
+        self.endRemoveRows()
+        return True
+
+    def fit_columns(self, data):
+        # Pads or cuts a 2D array to the number of columns of this table
+        data = np.asarray(data, dtype=np.float64)
+        fitted = np.full((len(data), self.array.shape[1]), np.nan)
+        cols = min(data.shape[1], fitted.shape[1]) if data.ndim == 2 else 0
+        fitted[:, :cols] = data[:, :cols]
+        return fitted
+
+    def set_array(self, data):
+        self.beginResetModel()
+        self.array = self.fit_columns(data)
+        self.flagged = np.zeros(len(self.array), dtype=bool)
+        self.endResetModel()
+
+    def update_array(self, data):
+        # Replaces the contents but only signals the rows that changed, returns their indices
+        data = self.fit_columns(data)
+        old_rows = self.rowCount()
+        if len(data) > old_rows:
+            self.insertRows(old_rows, len(data) - old_rows)
+        elif len(data) < old_rows:
+            self.removeRows(len(data), old_rows - len(data))
+        changed = (self.array != data) & ~(np.isnan(self.array) & np.isnan(data))
+        rows = np.nonzero(changed.any(axis=1))[0]
+        self.array = data
+        # one dataChanged per run of consecutive changed rows
+        for run in np.split(rows, np.nonzero(np.diff(rows) != 1)[0] + 1):
+            if len(run):
+                self.dataChanged.emit(self.index(run[0], 0), self.index(run[-1], self.array.shape[1] - 1))
+        return sorted(set(rows.tolist()) | set(range(len(data), old_rows)))
+
+    def set_values(self, rows, cols, values):
+        # Writes a block of cells (row indices x column indices) with a single dataChanged
+        rows = np.atleast_1d(rows)
+        cols = np.atleast_1d(cols)
+        if len(rows) == 0 or len(cols) == 0:
+            return
+        self.array[np.ix_(rows, cols)] = values
+        self.dataChanged.emit(self.index(int(rows.min()), int(cols.min())), self.index(int(rows.max()), int(cols.max())))
+
+    def set_flagged(self, rows):
+        # Highlights the given rows (and only those)
+        flagged = np.zeros(len(self.array), dtype=bool)
+        flagged[np.asarray(rows, dtype=np.intp)] = True
+        if (flagged != self.flagged).any():
+            self.flagged = flagged
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.array) - 1, self.array.shape[1] - 1), [Qt.BackgroundRole, Qt.ToolTipRole])
 
 NumAngles = 10
 minAngle = 15
@@ -207,11 +252,35 @@ maxAngle = 65
 stepAngle = 5
 CROSS_SEC_INDEX = 11
 INPUT_INDEX = 0
+WATCH_INTERVAL = 2000 # ms between polls of the watched folder
+JOURNAL_COMPACT_INTERVAL = 60000 # ms between checks whether the autosave journal needs compacting
+JOURNAL_COMPACT_RECORDS = 5000 # journal records after which it is folded into the autosave snapshot
+MATCH_TOLERANCE = 1.0 # keV, default for matching the same state across the angle tabs
+POLY_ORDER = 2 # default order of the polynomial calibration next to the linear one
+FIT_KEYS = ('params', 'pcov', 'chi2_ndf', 'sigma', 'outliers', 'band', 'point_band') # calibration results kept per tab
+ROBUST_METHODS = ('None', 'Huber', 'RANSAC') # outlier handling of the calibration, 'None' fits every selected row
+CALIBRATION_RANGE = np.linspace(-200, 125, 600) # channels, roughly 0-7 MeV
+CALIBRATION_CACHE_SIZE = 128 # calibration results kept in memory, least recently used go first
+RESAMPLE_REPLICAS = 2000 # default number of bootstrap/Monte-Carlo replicas per angle
+RESAMPLE_PARALLEL_REPLICAS = 20000 # from this many replicas on they are split across a process pool
+JOINT_ANGLE_ORDER = 2 # degree in angle of the shared coefficients of the joint calibration
+LEVEL_TOLERANCE = 10.0 # keV, how far a peak may be from a reference level to be identified with it
+HISTOGRAM_RANGE = "0, 4096, 4096" # default lowest and highest position and number of bins of the event histograms
+HISTOGRAM_DIR = 'spectra' # event histograms go to this folder next to the event files
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.tables = []
+        self.fit_cache = FitCache()
+        self.calibration_cache = OrderedDict() # calibration_key -> (linear, poly)
+        self.level_library = None # (path, mtime, LevelLibrary) of the last level table read
+        self.stopping_tables = {} # path -> (mtime, StoppingTable)
+        self.fit_watcher = None
+        self.pending_tabs = {}
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setInterval(WATCH_INTERVAL)
+        self.watch_timer.timeout.connect(self.poll_watch_folder)
 
         self.setWindowTitle("SPS Calibration")
         self.setGeometry(100, 100, 1300, 725)   #1600,1125 OG size
@@ -229,11 +298,10 @@ class MainWindow(QMainWindow):
         self.toolbar.addAction(load_action)
 
         def create_input_tab(self, Name):
-            table = QTableWidget(self)
-            table.setRowCount(10)
-            table.setColumnCount(3)
+            model = ArrayTableModel(10, ["Angle (deg)", "BCI Hits", "BCI scale (nA)"], self)
+            table = QTableView(self)
+            table.setModel(model)
             table.setFixedSize(700, 600)
-            table.setHorizontalHeaderLabels(["Angle (deg)", "BCI Hits", "BCI scale (nA)"])
             table.setColumnWidth(0,225)
             table.setColumnWidth(1,225)
             table.setColumnWidth(2,225)
@@ -259,6 +327,100 @@ class MainWindow(QMainWindow):
 
             self.load_volume_file_button = QPushButton("Load Volume File", self)
             self.load_volume_file_button.clicked.connect(self.load_vol_file)
+
+            self.load_all_angles_button = QPushButton("Load All Angles", self)
+            self.load_all_angles_button.clicked.connect(self.load_all_angles)
+
+            self.spectra_label = QLabel("Spectra:", self)
+            spectra_input = QLineEdit()
+            spectra_input.setObjectName("Spectra:")
+
+            self.fit_spectra_button = QPushButton("Fit Spectra", self)
+            self.fit_spectra_button.clicked.connect(self.fit_all_spectra)
+
+            self.search_width_label = QLabel("Peak FWHM [ch]:", self)
+            search_width_input = QLineEdit(str(PEAK_WIDTH))
+            search_width_input.setObjectName("Peak FWHM [ch]:")
+
+            self.search_button = QPushButton("Search Peaks", self)
+            self.search_button.clicked.connect(self.search_all_spectra)
+
+            self.events_label = QLabel("Events:", self)
+            events_input = QLineEdit()
+            events_input.setObjectName("Events:")
+
+            self.histogram_range_label = QLabel("Position Range, Bins:", self)
+            histogram_range_input = QLineEdit(HISTOGRAM_RANGE)
+            histogram_range_input.setObjectName("Position Range, Bins:")
+
+            self.histogram_button = QPushButton("Histogram Events", self)
+            self.histogram_button.clicked.connect(self.histogram_all_events)
+
+            self.masses_label = QLabel("Masses [u] (beam, target, ejectile, residual):", self)
+            masses_input = QLineEdit()
+            masses_input.setObjectName("Masses [u]:")
+
+            self.beam_energy_label = QLabel("Beam Energy [MeV]:", self)
+            beam_energy_input = QLineEdit()
+            beam_energy_input.setObjectName("Beam Energy [MeV]:")
+
+            self.charge_label = QLabel("Charge [e]:", self)
+            charge_input = QLineEdit("1")
+            charge_input.setObjectName("Charge [e]:")
+
+            self.beam_stopping_label = QLabel("Beam Stopping Table:", self)
+            beam_stopping_input = QLineEdit()
+            beam_stopping_input.setObjectName("Beam Stopping Table:")
+
+            self.ejectile_stopping_label = QLabel("Ejectile Stopping Table:", self)
+            ejectile_stopping_input = QLineEdit()
+            ejectile_stopping_input.setObjectName("Ejectile Stopping Table:")
+
+            self.brho_order_label = QLabel("B\u03C1 Order:", self)
+            brho_order_input = QLineEdit(str(POLY_ORDER))
+            brho_order_input.setObjectName("B\u03C1 Order:")
+
+            self.brho_button = QPushButton("B\u03C1 Calibration", self)
+            self.brho_button.clicked.connect(self.brho_calibration)
+
+            self.level_file_label = QLabel("Level Table:", self)
+            level_file_input = QLineEdit()
+            level_file_input.setObjectName("Level Table:")
+
+            self.dispersion_label = QLabel("Dispersion [keV/ch]:", self)
+            dispersion_input = QLineEdit()
+            dispersion_input.setObjectName("Dispersion [keV/ch]:")
+
+            self.shift_label = QLabel("Shift [keV/deg]:", self)
+            shift_input = QLineEdit("0")
+            shift_input.setObjectName("Shift [keV/deg]:")
+
+            self.identify_button = QPushButton("Identify Levels", self)
+            self.identify_button.clicked.connect(self.identify_all_levels)
+
+            self.calibrate_all_button = QPushButton("Calibrate All Angles", self)
+            self.calibrate_all_button.clicked.connect(self.calibrate_all_angles)
+
+            self.joint_button = QPushButton("Joint Calibration", self)
+            self.joint_button.clicked.connect(self.joint_calibration)
+
+            self.angle_order_label = QLabel("Angle Order:", self)
+            angle_order_input = QLineEdit(str(JOINT_ANGLE_ORDER))
+            angle_order_input.setObjectName("Angle Order:")
+
+            self.replicas_label = QLabel("Replicas:", self)
+            replicas_input = QLineEdit(str(RESAMPLE_REPLICAS))
+            replicas_input.setObjectName("Replicas:")
+
+            self.bootstrap_button = QPushButton("Bootstrap Calibration", self)
+            self.bootstrap_button.clicked.connect(lambda: self.resample_all_angles('bootstrap'))
+
+            self.montecarlo_button = QPushButton("Monte-Carlo Calibration", self)
+            self.montecarlo_button.clicked.connect(lambda: self.resample_all_angles('montecarlo'))
+
+            self.watch_button = QPushButton("Watch Folder", self)
+            self.watch_button.setCheckable(True)
+            self.watch_button.toggled.connect(self.watch_folder)
             
             text_display = QTextEdit()
             text_display.setReadOnly(True)
@@ -302,6 +464,65 @@ class MainWindow(QMainWindow):
             left_layout.addWidget(self.load_button)
             left_layout.addWidget(text_display)
             right_layout.addWidget(self.load_volume_file_button)
+            right_layout.addWidget(self.load_all_angles_button)
+            events_layout = QHBoxLayout()
+            events_layout.addWidget(self.events_label)
+            events_layout.addWidget(events_input)
+            events_layout.addWidget(self.histogram_range_label)
+            events_layout.addWidget(histogram_range_input)
+            events_layout.addWidget(self.histogram_button)
+            right_layout.addLayout(events_layout)
+            spectra_layout = QHBoxLayout()
+            spectra_layout.addWidget(self.spectra_label)
+            spectra_layout.addWidget(spectra_input)
+            spectra_layout.addWidget(self.search_width_label)
+            spectra_layout.addWidget(search_width_input)
+            spectra_layout.addWidget(self.search_button)
+            spectra_layout.addWidget(self.fit_spectra_button)
+            right_layout.addLayout(spectra_layout)
+            reaction_layout = QHBoxLayout()
+            reaction_layout.addWidget(self.masses_label)
+            reaction_layout.addWidget(masses_input)
+            reaction_layout.addWidget(self.beam_energy_label)
+            reaction_layout.addWidget(beam_energy_input)
+            reaction_layout.addWidget(self.charge_label)
+            reaction_layout.addWidget(charge_input)
+            right_layout.addLayout(reaction_layout)
+            stopping_layout = QHBoxLayout()
+            stopping_layout.addWidget(self.beam_stopping_label)
+            stopping_layout.addWidget(beam_stopping_input)
+            stopping_layout.addWidget(self.ejectile_stopping_label)
+            stopping_layout.addWidget(ejectile_stopping_input)
+            right_layout.addLayout(stopping_layout)
+            brho_layout = QHBoxLayout()
+            brho_layout.addWidget(self.brho_order_label)
+            brho_layout.addWidget(brho_order_input)
+            brho_layout.addWidget(self.brho_button)
+            right_layout.addLayout(brho_layout)
+            level_layout = QHBoxLayout()
+            level_layout.addWidget(self.level_file_label)
+            level_layout.addWidget(level_file_input)
+            right_layout.addLayout(level_layout)
+            dispersion_layout = QHBoxLayout()
+            dispersion_layout.addWidget(self.dispersion_label)
+            dispersion_layout.addWidget(dispersion_input)
+            dispersion_layout.addWidget(self.shift_label)
+            dispersion_layout.addWidget(shift_input)
+            dispersion_layout.addWidget(self.identify_button)
+            right_layout.addLayout(dispersion_layout)
+            right_layout.addWidget(self.calibrate_all_button)
+            joint_layout = QHBoxLayout()
+            joint_layout.addWidget(self.angle_order_label)
+            joint_layout.addWidget(angle_order_input)
+            joint_layout.addWidget(self.joint_button)
+            right_layout.addLayout(joint_layout)
+            replicas_layout = QHBoxLayout()
+            replicas_layout.addWidget(self.replicas_label)
+            replicas_layout.addWidget(replicas_input)
+            replicas_layout.addWidget(self.bootstrap_button)
+            replicas_layout.addWidget(self.montecarlo_button)
+            right_layout.addLayout(replicas_layout)
+            right_layout.addWidget(self.watch_button)
             right_layout.addWidget(toolbar)
             right_layout.addWidget(canvas)
             split_layout = QHBoxLayout()
@@ -312,10 +533,28 @@ class MainWindow(QMainWindow):
             tab = QWidget()
             tab.setLayout(split_layout)
             tab.table = table
+            tab.model = model
             tab.text_display = text_display
             tab.name_input = name_input
             tab.targetThickness_input = targetThickness_input
             tab.molarMass_input = molarMass_input
+            tab.events_input = events_input
+            tab.histogram_range_input = histogram_range_input
+            tab.spectra_input = spectra_input
+            tab.search_width_input = search_width_input
+            tab.replicas_input = replicas_input
+            tab.angle_order_input = angle_order_input
+            tab.level_file_input = level_file_input
+            tab.masses_input = masses_input
+            tab.beam_energy_input = beam_energy_input
+            tab.charge_input = charge_input
+            tab.brho_order_input = brho_order_input
+            tab.beam_stopping_input = beam_stopping_input
+            tab.ejectile_stopping_input = ejectile_stopping_input
+            tab.canvas = canvas
+            tab.figure = figure
+            tab.dispersion_input = dispersion_input
+            tab.shift_input = shift_input
 
             self.tables.append(table)
 
@@ -325,11 +564,10 @@ class MainWindow(QMainWindow):
         def create_tab(self,Name):
 
             # Create table for data input
-            table = QTableWidget(self)
-            table.setRowCount(3)
-            table.setColumnCount(9)
+            model = ArrayTableModel(3, ["1 = Use", "Energy [keV]", "Uncertainty [keV]", "Position", "Uncertainty", "Width", "Uncertainty", "Volume", "Uncertainty"], self)
+            table = QTableView(self)
+            table.setModel(model)
             table.setFixedSize(750, 600)
-            table.setHorizontalHeaderLabels(["1 = Use", "Energy [keV]", "Uncertainty [keV]", "Position", "Uncertainty", "Width", "Uncertainty", "Volume", "Uncertainty"])
             table.setColumnWidth(0,75)
             table.setColumnWidth(1,105)
             table.setColumnWidth(2,105)
@@ -346,10 +584,22 @@ class MainWindow(QMainWindow):
             name_input = QLineEdit()
             name_input.setObjectName("Name Input")
 
+            self.order_label = QLabel("Polynomial Order:", self)
+            order_input = QLineEdit(str(POLY_ORDER))
+            order_input.setObjectName("Polynomial Order:")
+
+            self.robust_label = QLabel("Outliers:", self)
+            robust_input = QComboBox()
+            robust_input.addItems(ROBUST_METHODS)
+            robust_input.setObjectName("Outliers:")
+
             # Create "Run" button
             self.run_button = QPushButton("Run", self)
             self.run_button.clicked.connect(self.run)
 
+            self.spectrum_button = QPushButton("Plot Spectrum", self)
+            self.spectrum_button.clicked.connect(self.plot_spectrum)
+
             self.save_button = QPushButton("Save", self)
             self.save_button.clicked.connect(self.save)
 
@@ -376,17 +626,26 @@ class MainWindow(QMainWindow):
             right_layout = QVBoxLayout()
             
             h_layout = QHBoxLayout()
+            order_layout = QHBoxLayout()
             
             left_layout.addWidget(table)
             left_layout.addWidget(self.add_row_button)
             left_layout.addWidget(self.remove_row_button)
+            order_layout.addWidget(self.order_label)
+            order_layout.addWidget(order_input)
+            order_layout.addWidget(self.robust_label)
+            order_layout.addWidget(robust_input)
+            left_layout.addLayout(order_layout)
             h_layout.addWidget(self.name_label)
             h_layout.addWidget(name_input)
             left_layout.addLayout(h_layout)
             left_layout.addWidget(self.save_button)
             left_layout.addWidget(self.load_button)
             left_layout.addWidget(text_display)
-            right_layout.addWidget(self.run_button)
+            run_layout = QHBoxLayout()
+            run_layout.addWidget(self.run_button)
+            run_layout.addWidget(self.spectrum_button)
+            right_layout.addLayout(run_layout)
             right_layout.addWidget(toolbar)
             right_layout.addWidget(canvas)
             split_layout = QHBoxLayout()
@@ -397,10 +656,15 @@ class MainWindow(QMainWindow):
             tab = QWidget()
             tab.setLayout(split_layout)
             tab.table = table
+            tab.model = model
             tab.canvas = canvas
             tab.figure = figure
             tab.text_display = text_display
             tab.name_input = name_input
+            tab.order_input = order_input
+            tab.robust_input = robust_input
+            tab.calibration_drawn = None # (calibration_key, name) of the current plot
+            tab.spectrum = None # Spectrum shown in the figure, rebinned again on every zoom
             tab.toolbar = toolbar
 
             self.tables.append(table)
@@ -409,12 +673,11 @@ class MainWindow(QMainWindow):
 
         def create_cross_section_tab(self, Name):
             # Create table for data input
-            table = QTableWidget(self)
-            table.setRowCount(3)
-            table.setColumnCount(22)
+            model = ArrayTableModel(3, ["1 = Use", "Energy [keV]", "15-deg", "Uncert", "20-deg", "Uncert", "25-deg", "Uncert", "30-deg", "Uncert", "35-deg", "Uncert",\
+                                        "40-deg", "Uncert", "45-deg", "Uncert", "50-deg", "Uncert", "55-deg", "Uncert", "60-deg", "Uncert"], self)
+            table = QTableView(self)
+            table.setModel(model)
             table.setFixedSize(700, 600)  #1100,600 OG size
-            table.setHorizontalHeaderLabels(["1 = Use", "Energy [keV]", "15-deg", "Uncert", "20-deg", "Uncert", "25-deg", "Uncert", "30-deg", "Uncert", "35-deg", "Uncert",\
-                                                "40-deg", "Uncert", "45-deg", "Uncert", "50-deg", "Uncert", "55-deg", "Uncert", "60-deg", "Uncert"])
           
             for i in range(23):
                 if i == 0:
@@ -426,6 +689,10 @@ class MainWindow(QMainWindow):
             name_input = QLineEdit()
             name_input.setObjectName("Name Input")
 
+            self.tolerance_label = QLabel("Match Tolerance [keV]:", self)
+            tolerance_input = QLineEdit(str(MATCH_TOLERANCE))
+            tolerance_input.setObjectName("Match Tolerance [keV]:")
+
             # Create "Run" button
             self.run_button = QPushButton("Run", self)
             self.run_button.clicked.connect(self.run)
@@ -450,6 +717,9 @@ class MainWindow(QMainWindow):
 
             self.clear_plot_button = QPushButton("Clear Plots", self)
             self.clear_plot_button.clicked.connect(self.clear_plots)
+
+            self.cm_frame_button = QPushButton("CM Frame", self)
+            self.cm_frame_button.setCheckable(True)
             
             text_display = QTextEdit()
             text_display.setReadOnly(True)
@@ -471,10 +741,14 @@ class MainWindow(QMainWindow):
             right_layout = QVBoxLayout()
             
             h_layout = QHBoxLayout()
+            tolerance_layout = QHBoxLayout()
             
             left_layout.addWidget(table)
             left_layout.addWidget(self.add_row_button)
             left_layout.addWidget(self.remove_row_button)
+            tolerance_layout.addWidget(self.tolerance_label)
+            tolerance_layout.addWidget(tolerance_input)
+            left_layout.addLayout(tolerance_layout)
             h_layout.addWidget(self.name_label)
             h_layout.addWidget(name_input)
             left_layout.addLayout(h_layout)
@@ -487,6 +761,7 @@ class MainWindow(QMainWindow):
             right_layout.addWidget(self.save_x_sec_button)
             right_layout.addWidget(self.save_x_sec_plot_button)
             right_layout.addWidget(self.clear_plot_button)
+            right_layout.addWidget(self.cm_frame_button)
             right_layout.addWidget(toolbar)
             #right_layout.addWidget(canvas)
 
@@ -505,10 +780,13 @@ class MainWindow(QMainWindow):
             tab = QWidget()
             tab.setLayout(split_layout)
             tab.table = table
+            tab.model = model
             tab.canvas = canvas
             tab.figure = figure
             tab.text_display = text_display
             tab.name_input = name_input
+            tab.tolerance_input = tolerance_input
+            tab.cm_frame_button = self.cm_frame_button
             tab.toolbar = toolbar
             tab.scroll_area = scroll_area
 
@@ -560,15 +838,27 @@ class MainWindow(QMainWindow):
         central_widget.setLayout(central_layout)
         self.setCentralWidget(central_widget)
         self.tabwidget = tabwidget
+        tabwidget.currentChanged.connect(lambda index: self.hydrate_tabs([index]))
+
+        # Autosave journal, every table and line edit change is recorded as it happens
+        self.journal = SessionJournal()
+        self.journal_paused = False
+        self.journal_cells = []
+        self.journal_error = None # last autosave failure shown in the status bar
+        for tab_index in range(tabwidget.count()):
+            self.connect_journal(tab_index)
+        self.journal_timer = QTimer(self)
+        self.journal_timer.setInterval(JOURNAL_COMPACT_INTERVAL)
+        self.journal_timer.timeout.connect(self.compact_journal)
+        self.journal_timer.start()
 
 
     def add_row(self):
         current_tab_index = self.tabwidget.currentIndex()
         current_tab = self.tabwidget.widget(current_tab_index)
 
-        table = current_tab.table
-        row_count = table.rowCount()
-        table.insertRow(row_count)
+        model = current_tab.model
+        model.insertRows(model.rowCount(), 1)
 
     def remove_row(self):
 
@@ -579,12 +869,11 @@ class MainWindow(QMainWindow):
         selected_rows = table.selectedIndexes()
         if selected_rows:
             row = selected_rows[0].row()
-            table.removeRow(row)
+            current_tab.model.removeRows(row, 1)
     
     def load_vol_file(self):
         current_tab_index = self.tabwidget.currentIndex()
         current_tab = self.tabwidget.widget(current_tab_index)
-        current_table = current_tab.table
         # canvas = current_tab.canvas
         # figure = current_tab.figure
         text_display = current_tab.text_display
@@ -593,6 +882,7 @@ class MainWindow(QMainWindow):
 
         # Get name from input field
         name = name_input.text()
+        self.hydrate_tabs()
 
         data = []
         with open(name, 'r') as f:
@@ -602,24 +892,332 @@ class MainWindow(QMainWindow):
         energy = name.split('_')[0]
         i=0
         for tab_index in range(1, self.tabwidget.count() - 1):
-            tab = self.tabwidget.widget(tab_index)
-            current_table = tab.findChild(QTableWidget)
-            row = get_next_blank_row(current_table)
-            current_table.setItem(row,1, QTableWidgetItem(energy))
-            current_table.setItem(row,7, QTableWidgetItem(str(data[i][0])))
-            current_table.setItem(row,8, QTableWidgetItem(str(data[i][1])))
+            model = self.tabwidget.widget(tab_index).model
+            row = get_next_blank_row(model)
+            if row == model.rowCount():
+                model.insertRows(row, 1)
+            model.set_values([row], [1], float(energy))
+            model.set_values([row], [7, 8], [float(data[i][0]), float(data[i][1])])
             i+=1
 
         text_display.setPlainText(f"File {name} loaded successfully")
 
     
+    def angle_tab(self, angle):
+        return self.tabwidget.widget(1 + (angle - minAngle) // stepAngle)
+
+    def BCI_columns(self, count):
+        # BCI hits and scale of the first count angles from the Input tab as a (count, 2) array,
+        # nan for angles that have no row there
+        BCI = np.full((count, 2), np.nan)
+        data = self.tabwidget.widget(INPUT_INDEX).model.array[:count, 1:3]
+        BCI[:len(data)] = data
+        return BCI
+
+    def reaction(self):
+        # (masses, beam energy) from the Input tab, raises ValueError if they are not filled in
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        return parse_masses(input_tab.masses_input.text()), float(input_tab.beam_energy_input.text())
+
+    def load_stopping(self, path):
+        # Stopping tables are read again only when the file changed, the same object is handed out
+        # otherwise so the cached rigidity tables stay valid
+        mtime = os.stat(path).st_mtime_ns
+        if path not in self.stopping_tables or self.stopping_tables[path][0] != mtime:
+            self.stopping_tables[path] = (mtime, load_stopping_table(path))
+        return self.stopping_tables[path][1]
+
+    def target_energy_loss(self, beam_energy):
+        # (thickness [mg/cm^2], beam table, ejectile table) for the energy loss corrections, None when
+        # the Input tab has no stopping tables. Raises OSError/ValueError for unreadable input and for
+        # a beam energy [MeV] above the beam stopping table
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        beam_path = input_tab.beam_stopping_input.text().strip()
+        ejectile_path = input_tab.ejectile_stopping_input.text().strip()
+        if not beam_path and not ejectile_path:
+            return None
+        thickness = float(input_tab.targetThickness_input.text()) / 1000 # ug/cm^2 -> mg/cm^2
+        beam_table = self.load_stopping(beam_path or ejectile_path)
+        ejectile_table = self.load_stopping(ejectile_path or beam_path)
+        if beam_energy > beam_table.max_energy:
+            raise ValueError(f"the beam energy {beam_energy} MeV is outside the loaded stopping table {beam_path or ejectile_path}, which ends at {beam_table.max_energy} MeV")
+        return thickness, beam_table, ejectile_table
+
+    def frame_angles(self, states, cross_sections, errors, angles, text_display):
+        # Angles, cross-sections and errors per state for plotting, converted to the CM frame when the
+        # "CM Frame" button of the Cross Sections tab is down. Also returns the axis label
+        lab = ([angles] * len(states), cross_sections, errors, r'Lab Angle [$\Theta_{lab}$]')
+        if not self.tab_crossSec.cm_frame_button.isChecked() or len(states) == 0:
+            return lab
+        try:
+            masses, beam_energy = self.reaction()
+        except ValueError:
+            text_display.append("Enter the reaction masses and beam energy on the Input tab for CM angles, plotting in the lab frame")
+            return lab
+        # every state x angle at once, states are in keV
+        table = kinematics_table(masses, beam_energy, tuple(np.asarray(states, dtype=np.float64) / 1000), tuple(float(angle) for angle in angles))
+        return (list(table['theta_cm']), list(np.asarray(cross_sections) * table['jacobian']),
+                list(np.asarray(errors) * table['jacobian']), r'CM Angle [$\Theta_{cm}$]')
+
+    def match_tolerance(self):
+        try:
+            return abs(float(self.tab_crossSec.tolerance_input.text()))
+        except ValueError:
+            return MATCH_TOLERANCE
+
+    def load_all_angles(self):
+        # Loads the HDTV fit file of every angle tab at once, the name field holds a directory
+        # or a file pattern ('run_{angle}deg.fit' or 'run_*deg.fit')
+        current_tab = self.tabwidget.widget(INPUT_INDEX)
+        text_display = current_tab.text_display
+        source = current_tab.name_input.text()
+
+        angles = list(range(minAngle, maxAngle, stepAngle))
+        skipped = []
+        files = find_angle_files(source, angles, skipped=skipped)
+        if not files:
+            text_display.setPlainText(f"No .fit/.xml files found for any angle in: {source}")
+            for path, reason in skipped:
+                text_display.append(f"Skipped {path}: {reason}")
+            return
+
+        # a malformed or half-written file gives its error, the good angles still load
+        results = self.fit_cache.read_many(files.values())
+
+        self.tabwidget.setUpdatesEnabled(False)
+        for angle, result in zip(files, results):
+            if isinstance(result, Exception):
+                continue
+            peaks, cal_flag = result
+            tab = self.angle_tab(angle)
+            self.pending_tabs.pop(self.tabwidget.indexOf(tab), None)
+            fill_table(tab.model, fit_to_table(peaks))
+            if cal_flag:
+                tab.text_display.setPlainText("Calibrated data set, position & uncertainty in [keV]")
+            else:
+                tab.text_display.setPlainText("Uncalibrated data set, position & uncertainty in [channel]")
+        self.tabwidget.setUpdatesEnabled(True)
+
+        failed = sum(isinstance(result, Exception) for result in results)
+        text_display.setPlainText(f"Loaded {len(files) - failed} of {len(angles)} angles" + (f", skipped {len(skipped)} file(s):" if skipped else ":"))
+        for (angle, path), result in zip(files.items(), results):
+            if isinstance(result, Exception):
+                text_display.append(f"{angle}-deg: could not read {path}: {result}")
+            else:
+                text_display.append(f"{angle}-deg: {path}")
+        for path, reason in skipped:
+            text_display.append(f"Skipped {path}: {reason}")
+        text_display.append(self.fit_cache.stats())
+
+    def histogram_all_events(self):
+        # Builds the position spectrum of every angle from its event files (directory or pattern as for
+        # Load All Angles, several runs per angle are summed) and points the spectra field at them
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        text_display = input_tab.text_display
+        source = input_tab.events_input.text()
+        try:
+            lo, hi, bins = (float(field) for field in input_tab.histogram_range_input.text().replace(',', ' ').split())
+            bins = int(bins)
+        except ValueError:
+            text_display.setPlainText("Enter the lowest and highest position and the number of bins, e.g. '0, 4096, 4096'")
+            return
+        if hi <= lo or bins < 1:
+            text_display.setPlainText("The highest position has to be above the lowest and at least one bin is needed")
+            return
+        skipped = []
+        files = find_angle_runs(source, list(range(minAngle, maxAngle, stepAngle)), EVENT_EXTENSIONS, skipped)
+        if not files:
+            text_display.setPlainText(f"No event files found for any angle in: {source}")
+            for path, reason in skipped:
+                text_display.append(f"Skipped {path}: {reason}")
+            return
+        directory = os.path.join(os.path.dirname(next(iter(files.values()))[0]), HISTOGRAM_DIR)
+        try:
+            pattern, spectra = histogram_angles(files, lo, hi, bins, directory)
+        except (OSError, ValueError) as e:
+            text_display.setPlainText(f"Could not histogram the events in {source}: {e}")
+            return
+
+        input_tab.spectra_input.setText(pattern)
+        text_display.setPlainText(f"Histogrammed the events of {len(spectra)} angles into {pattern}, {bins} bins from {lo} to {hi}:")
+        for angle, (count, counts) in spectra.items():
+            text_display.append(f"{angle}-deg: {count} file(s), {counts.sum()} events in range")
+        for path, reason in skipped:
+            text_display.append(f"Skipped {path}: {reason}")
+        text_display.append("Search Peaks and Fit Spectra now work on these spectra")
+
+    def spectrum_files(self):
+        # {angle: path} of the raw spectra named by the spectra field of the Input tab
+        source = self.tabwidget.widget(INPUT_INDEX).spectra_input.text()
+        return find_angle_files(source, list(range(minAngle, maxAngle, stepAngle)), SPECTRUM_EXTENSIONS)
+
+    def plot_spectrum(self):
+        # Shows the raw spectrum of the current angle tab with the table positions marked. The file is
+        # memory mapped and only the visible range is read, rebinned to the width of the plot
+        tab_index = self.tabwidget.currentIndex()
+        tab = self.tabwidget.widget(tab_index)
+        angle = minAngle + (tab_index - 1) * stepAngle
+        path = self.spectrum_files().get(angle)
+        if path is None:
+            tab.text_display.setPlainText(f"No {angle}-deg spectrum found in: {self.tabwidget.widget(INPUT_INDEX).spectra_input.text()}")
+            return
+        try:
+            tab.spectrum = Spectrum(path)
+        except (OSError, ValueError) as e:
+            tab.text_display.setPlainText(f"Could not read the spectrum {path}: {e}")
+            return
+        self.hydrate_tabs([tab_index])
+
+        figure = tab.figure
+        figure.clear()
+        ax = figure.add_subplot(111)
+        ax.step(*tab.spectrum.view(), where='mid', color='k', linewidth=0.8)
+        for pos in tab.model.array[:, 3][~np.isnan(tab.model.array[:, 3])]:
+            ax.axvline(pos, color='r', linewidth=0.6, alpha=0.6)
+        ax.set_xlabel('Position [Channel]')
+        ax.set_ylabel('Counts')
+        ax.set_title(f"{angle}-deg: {os.path.basename(path)}")
+        ax.callbacks.connect('xlim_changed', lambda ax: self.rebin_spectrum(tab, ax))
+        tab.calibration_drawn = None
+        tab.canvas.draw()
+        tab.text_display.setPlainText(f"Spectrum {path}: {len(tab.spectrum)} channels")
+
+    def rebin_spectrum(self, tab, ax):
+        # Zooming reads the new range of the spectrum at a finer binning
+        lo, hi = ax.get_xlim()
+        ax.lines[0].set_data(*tab.spectrum.view(lo, hi))
+        tab.canvas.draw_idle()
+
+    def search_all_spectra(self):
+        # Peak search over the whole raw spectrum of every angle at once. Candidates that no row of the
+        # angle tab has yet are added to it, the rows already there are left alone. Fit Spectra then
+        # refines them
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        text_display = input_tab.text_display
+        files = self.spectrum_files()
+        if not files:
+            text_display.setPlainText(f"No spectra found for any angle in: {input_tab.spectra_input.text()}")
+            return
+        try:
+            sigma = abs(float(input_tab.search_width_input.text())) / FWHM_PER_SIGMA
+            results = search_spectra(files.values(), sigma)
+        except ValueError:
+            text_display.setPlainText("Enter the typical peak FWHM [channels] as a number")
+            return
+        except OSError as e:
+            text_display.setPlainText(f"Could not read the spectra: {e}")
+            return
+        self.hydrate_tabs()
+
+        text_display.setPlainText(f"Peak search in the spectra of {len(files)} angles:")
+        for (angle, path), found in zip(files.items(), results):
+            tab = self.angle_tab(angle)
+            rows = np.full((len(found), tab.model.columnCount()), np.nan)
+            rows[:, 3:9] = found
+            added = update_table(tab.model, add_fit_rows(tab.model.array, rows))
+            text_display.append(f"{angle}-deg: {len(found)} candidates in {path}, {len(added)} new")
+
+    def fit_all_spectra(self):
+        # Refits the peaks of every angle tab in its raw spectrum, all angles at once in a process pool.
+        # The spectra field holds a directory or a file pattern as for Load All Angles, the table
+        # positions (and widths if there are any) are the starting point of the fits
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        text_display = input_tab.text_display
+        source = input_tab.spectra_input.text()
+        files = self.spectrum_files()
+        if not files:
+            text_display.setPlainText(f"No spectra found for any angle in: {source}")
+            return
+        self.hydrate_tabs()
+
+        tabs, rows = [], []
+        for angle in files:
+            tab = self.angle_tab(angle)
+            tabs.append(tab)
+            rows.append(np.nonzero(~np.isnan(tab.model.array[:, 3]))[0])
+        try:
+            results = fit_spectra(files.values(), [tab.model.array[r, 3] for tab, r in zip(tabs, rows)],
+                                  [tab.model.array[r, 5] for tab, r in zip(tabs, rows)])
+        except (OSError, ValueError) as e:
+            text_display.setPlainText(f"Could not read the spectra in {source}: {e}")
+            return
+
+        text_display.setPlainText(f"Fitted the spectra of {len(files)} angles:")
+        for (angle, path), tab, r, fitted in zip(files.items(), tabs, rows, results):
+            good = ~np.isnan(fitted[:, 0])
+            tab.model.set_values(r[good], list(range(3, 9)), fitted[good])
+            text_display.append(f"{angle}-deg: {good.sum()} of {len(r)} peaks from {path}")
+
+    def watch_folder(self, checked):
+        # Online mode: polls the Input tab name field (directory or pattern, as for Load All Angles)
+        # and re-ingests only the fit files that HDTV rewrote since the last poll
+        text_display = self.tabwidget.widget(INPUT_INDEX).text_display
+        if not checked:
+            self.watch_timer.stop()
+            self.fit_watcher = None
+            text_display.append("Stopped watching")
+            return
+
+        source = self.tabwidget.widget(INPUT_INDEX).name_input.text()
+        self.fit_watcher = FitWatcher(source, list(range(minAngle, maxAngle, stepAngle)))
+        text_display.setPlainText(f"Watching {source}")
+        self.poll_watch_folder()
+        self.watch_timer.start()
+
+    def poll_watch_folder(self):
+        text_display = self.tabwidget.widget(INPUT_INDEX).text_display
+        changed = self.fit_watcher.poll()
+        if not changed:
+            return
+
+        results = self.fit_cache.read_many(changed.values())
+        # most likely HDTV is still writing these files, they are read again on the next poll
+        failed = [angle for angle, result in zip(changed, results) if isinstance(result, Exception)]
+        self.fit_watcher.forget(failed)
+        for angle, result in zip(changed, results):
+            if isinstance(result, Exception):
+                text_display.append(f"{angle}-deg: could not read {changed[angle]}, retrying: {result}")
+                continue
+            peaks, cal_flag = result
+            self.hydrate_tabs([self.tabwidget.indexOf(self.angle_tab(angle))])
+            model = self.angle_tab(angle).model
+            rows = update_table(model, merge_fit_rows(get_table_data(model), fit_to_table(peaks)))
+            text_display.append(f"{angle}-deg: {len(rows)} row(s) updated from {changed[angle]}")
+        updated = [angle for angle in changed if angle not in failed]
+        if updated:
+            self.update_cross_sections(updated)
+
+    def update_cross_sections(self, angles):
+        # Recomputes the cross-section columns of the given angles for the states already listed
+        # in the Cross Sections tab, leaving every other angle untouched
+        self.hydrate_tabs([INPUT_INDEX, CROSS_SEC_INDEX] + [self.tabwidget.indexOf(self.angle_tab(angle)) for angle in angles])
+        cross_model = self.tab_crossSec.model
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        try:
+            targetThickness = float(input_tab.targetThickness_input.text())
+            molarMass = float(input_tab.molarMass_input.text())
+        except ValueError:
+            return
+
+        BCI = self.BCI_columns(NumAngles)
+        energies = cross_model.array[:, 1]
+        for angle in angles:
+            l = (angle - minAngle) // stepAngle
+            k = 2 + 2 * l
+            if np.isnan(BCI[l]).any():
+                continue
+            data = self.angle_tab(angle).model.array
+            rows = match_states(energies, data[:, 1], self.match_tolerance())
+            found = np.nonzero(rows >= 0)[0]
+            x_sec, error = cross_section_calculation(BCI[l, 0], BCI[l, 1], targetThickness, molarMass, data[rows[found], 7], data[rows[found], 8])
+            cross_model.set_values(found, [k, k + 1], np.column_stack([x_sec, error]))
+
     def save_cross_section(self):
         current_tab_index = self.tabwidget.currentIndex()
         current_tab = self.tabwidget.widget(current_tab_index)
-        current_table = current_tab.table
         text_display = current_tab.text_display
 
-        data = get_table_data(current_table)
+        data = get_table_data(current_tab.model)
         break_flag = False
         counter = 0
         file_list = []
@@ -685,161 +1283,384 @@ class MainWindow(QMainWindow):
     def run(self):
         current_tab_index = self.tabwidget.currentIndex()
         current_tab = self.tabwidget.widget(current_tab_index)
-        current_table = current_tab.table
         canvas = current_tab.canvas
-        figure = current_tab.figure
         text_display = current_tab.text_display
-        name_input = current_tab.name_input
-
-
-        # Get name from input field
-        name = name_input.text()
         text_display.clear()
 
         if current_tab_index != CROSS_SEC_INDEX and current_tab_index != INPUT_INDEX:
-            # Get data from table
-            data = get_table_data(current_table)
-            figure.clear()
-            
-            
-            ##########################################################################################################################################
-            length = len(data)
-
-            pos = np.array([])
-            pos_err = np.array([])
-            energy = np.array([])
-            energy_err = np.array([])
-            width = np.array([])
-            width_err = np.array([])
-            vol = np.array([])
-            vol_err = np.array([])
-
-            for i in range(length):
-                if data[i][0] == 1:
-                    energy = np.append(energy,data[i][1])
-                    energy_err = np.append(energy_err,data[i][2])
-                    pos = np.append(pos,data[i][3])
-                    pos_err = np.append(pos_err,data[i][4])
-                    width = np.append(width,data[i][5])
-                    width_err = np.append(width_err,data[i][6])
-                    vol = np.append(vol, data[i][7])
-                    vol_err = np.append(vol_err, data[i][8])
-
-
-            k=1
-            def weight_func(x,y,x_err,y_err):
-                return np.sqrt((x_err*k)**2+(y_err)**2)
-            
-            # Angle Tabs 
-            # Fit the data using curve_fit
-            popt_linear, pcov_linear = curve_fit(linear_func, pos, energy, sigma=weight_func(pos,energy,pos_err,energy_err), absolute_sigma=True)
-            slope, intercept = popt_linear
-            
-            popt_poly2, pcov_poly2 = curve_fit(poly2_func, pos, energy, sigma=weight_func(pos,energy,pos_err,energy_err), absolute_sigma=True)
-            a_2, b_2, c_2 = popt_poly2
-
-            text_display.setPlainText(f"Linear: [0, {slope}, {intercept}]\nPolynomial: [{a_2}, {b_2}, {c_2}]")
-
-            # Get the energy calibrated
-            energy_calibrated_linear = linear_func(pos,slope,intercept)
-            energy_calibrated_poly2 = poly2_func(pos,a_2,b_2,c_2)
-            
-            #0-7 MeV Range
-            pos_range = np.linspace(-200,125,600)
-            Total_energy_calibrated_linear = linear_func(pos_range,slope,intercept)
-            Total_energy_calibrated_poly2 = poly2_func(pos_range,a_2,b_2,c_2)
-
-            # Get the residuals
-            residuals_linear = energy - energy_calibrated_linear
-            residuals_poly2 = energy - energy_calibrated_poly2
-
-            # Plot energy vs position
-            ax1 = figure.add_subplot(211)        
-            ax1.errorbar(pos, energy, xerr=pos_err, yerr=energy_err, fmt='ko', label='Data')
-            ax1.plot(pos_range, Total_energy_calibrated_linear,'r', label='Linear')
-            ax1.plot(pos_range, Total_energy_calibrated_poly2,'b', label='2nd Order Polynomial')
-            ax1.set_xlabel('Position [Channel]')
-            ax1.set_ylabel('Energy [keV]')
-            ax1.set_title(f"{name}")
-            ax1.legend()
-
-            # Plot residuals
-            ax2 = figure.add_subplot(212)        
-            ax2.plot(energy, np.zeros(len(energy)),'k')
-            ax2.errorbar(energy, residuals_linear, yerr=weight_func(pos,energy,pos_err,energy_err), fmt='ro', label='Linear', capsize=4)
-            ax2.errorbar(energy, residuals_poly2, yerr=weight_func(pos,energy,pos_err,energy_err), fmt='bo', label='2nd Order Polynomial', capsize=4)
-            ax2.set_xlabel('Energy [keV]')
-            ax2.set_ylabel('Residuals')
-            ax2.legend()
-
-            figure.subplots_adjust(top=0.95, bottom=0.05)
-
-            figure.savefig(f"{name}")
+            # Angle Tabs
+            self.run_calibration([current_tab_index])
 
         elif current_tab_index == CROSS_SEC_INDEX:
             # Cross section tab
+            self.hydrate_tabs()
 
-            max_rows = 0
-            for tab in range(1,self.tabwidget.count() - 1):
-                table = self.tabwidget.widget(tab).findChild(QTableWidget)
-                if table.rowCount() > max_rows:
-                    max_rows = table.rowCount()
-            matched_rows = []
-            energy_list = []
-            count = 0 # counter that sets the row in the cross-section table
-            for i in range(max_rows):
-                if self.tabwidget.widget(1).findChild(QTableWidget).item(i, 1) is not None:
-                    energy = self.tabwidget.widget(1).findChild(QTableWidget).item(i, 1).text()
-                    energy_list.append(energy)
-                    matching_rows = []
-                    for tab in range(1, self.tabwidget.count() - 1):
-                        table = self.tabwidget.widget(tab).findChild(QTableWidget)
-                        for row in range(table.rowCount()):
-                            if table.item(row, 1) is not None:
-                                if table.item(row, 1).text() == energy:
-                                    matching_rows.append(row)
-                    if len(matching_rows) == self.tabwidget.count() - 2:
-                        matched_rows.append((count, matching_rows))
-                        count +=1
-                else:
-                    continue
+            angle_data = [self.tabwidget.widget(tab).model.array for tab in range(1, self.tabwidget.count() - 1)]
+
+            # states are taken from the first angle tab and matched in every angle within the tolerance,
+            # angles where a state is not found are left empty
+            reference = angle_data[0][:, 1]
+            reference = reference[~np.isnan(reference)]
+            matches = match_states_across(reference, [data[:, 1] for data in angle_data], self.match_tolerance())
 
-            current_table.setRowCount(len(matched_rows))
             targetThickness = float(self.tabwidget.widget(0).targetThickness_input.text())
             molarMass = float(self.tabwidget.widget(0).molarMass_input.text())
+            BCI = self.BCI_columns(len(angle_data))
+
+            # (states, angles) volume matrices, every cross-section comes out of one call
+            # row -1 (not found) picks the empty row added at the end of every table
+            padded = [np.vstack([data, np.full((1, data.shape[1]), np.nan)]) for data in angle_data]
+            volumes = np.column_stack([data[rows, 7] for data, rows in zip(padded, matches.T)])
+            volume_errs = np.column_stack([data[rows, 8] for data, rows in zip(padded, matches.T)])
+            x_sec, error = cross_section_calculation(BCI[:, 0], BCI[:, 1], targetThickness, molarMass, volumes, volume_errs)
+
+            # the "1 = Use" column is kept, everything else is recomputed
+            old = current_tab.model.array
+            result = np.full((len(reference), old.shape[1]), np.nan)
+            keep = min(len(old), len(result))
+            result[:keep, 0] = old[:keep, 0]
+            result[:, 1] = reference
+            result[:, 2::2] = x_sec
+            result[:, 3::2] = error
+            current_tab.model.set_array(result)
+            text_display.setPlainText("All possible cross-sections calculated!")
 
-            temp = []
-            for i in energy_list:  # flush out any 'nans' that made it into the energy list
-                if np.isnan(float(i)):
+        canvas.draw()
+    def calibrate_all_angles(self):
+        self.hydrate_tabs()
+        self.run_calibration(list(range(1, self.tabwidget.count() - 1)))
+        self.tabwidget.widget(INPUT_INDEX).text_display.setPlainText("Calibrated all angle tabs, see the fit results in each tab")
+
+    def load_levels(self, path):
+        # The level table is read again only when the file changed
+        mtime = os.stat(path).st_mtime_ns
+        if self.level_library is None or self.level_library[:2] != (path, mtime):
+            self.level_library = (path, mtime, load_level_library(path))
+        return self.level_library[2]
+
+    def identify_all_levels(self):
+        # Fills Energy/Uncertainty of every angle tab from the reference level table: the peak positions
+        # are put on a first energy scale (dispersion guess, kinematic shift between angles) and each
+        # level is then assigned to at most one peak per angle
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        text_display = input_tab.text_display
+        path = input_tab.level_file_input.text()
+        try:
+            library = self.load_levels(path)
+            dispersion = float(input_tab.dispersion_input.text())
+            shift = float(input_tab.shift_input.text() or 0)
+        except OSError as e:
+            text_display.setPlainText(f"Could not read the level table {path}: {e}")
+            return
+        except ValueError:
+            text_display.setPlainText("Enter the dispersion [keV/ch] and the shift between angles [keV/deg] as numbers")
+            return
+        if len(library) == 0:
+            text_display.setPlainText(f"No levels found in {path}")
+            return
+        self.hydrate_tabs()
+
+        tab_indices = list(range(1, self.tabwidget.count() - 1))
+        tabs = [self.tabwidget.widget(tab_index) for tab_index in tab_indices]
+        angles = np.array([minAngle + (tab_index - 1) * stepAngle for tab_index in tab_indices])
+        positions = stack_ragged([tab.model.array[:, 3] for tab in tabs])
+        predicted = identify_levels(positions, angles, library, dispersion, shift, LEVEL_TOLERANCE)
+
+        identified = 0
+        for tab, energies in zip(tabs, predicted):
+            rows = match_states(library.energies, energies[:tab.model.rowCount()], LEVEL_TOLERANCE)
+            found = np.nonzero(rows >= 0)[0]
+            tab.model.set_values(rows[found], [1, 2], np.column_stack([library.energies[found], library.errors[found]]))
+            identified += len(found)
+        text_display.setPlainText(f"Identified {identified} peak(s) in {len(tabs)} angle tabs with {len(library)} reference levels from {path}")
+
+    def brho_calibration(self):
+        # Focal-plane calibration in magnetic rigidity: the reference energies of every angle tab are
+        # turned into the ejectile B*rho of that angle and one polynomial B*rho(position) is fitted to
+        # the points of all angles. Every peak of every tab is then turned back into an excitation energy
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        text_display = input_tab.text_display
+        try:
+            masses, beam_energy = self.reaction()
+            charge = float(input_tab.charge_input.text())
+            order = max(1, int(input_tab.brho_order_input.text()))
+        except ValueError:
+            text_display.setPlainText("Enter the reaction masses, beam energy, charge and B\u03C1 order on the Input tab")
+            return
+        try:
+            target = self.target_energy_loss(beam_energy)
+        except (OSError, ValueError) as e:
+            text_display.setPlainText(f"Could not set up the target energy loss (target thickness and stopping tables): {e}")
+            return
+        self.hydrate_tabs()
+
+        tab_indices = list(range(1, self.tabwidget.count() - 1))
+        tabs = [self.tabwidget.widget(tab_index) for tab_index in tab_indices]
+        angles = np.array([minAngle + (tab_index - 1) * stepAngle for tab_index in tab_indices], dtype=np.float64)
+        energy, energy_err, pos, pos_err = (stack_ragged(columns) for columns in zip(*[self.calibration_points(tab) for tab in tabs]))
+
+        # reference points in B*rho of the ejectile leaving the target, energies in the tables are keV
+        excitation = energy / 1000
+        brho = rigidity(two_body_in_target(masses, beam_energy, excitation, angles[:, None], target)['momentum'], charge)
+        brho_err = np.abs(rigidity_derivative(masses, beam_energy, charge, excitation, angles[:, None], target=target)) * energy_err / 1000
+        # nan above the reaction threshold or for ejectile energies outside the ejectile stopping table
+        dropped = int((~np.isnan(excitation) & np.isnan(brho)).sum())
+        params, pcov, chi2_ndf, _ = fit_effective_variance(pos.ravel(), brho.ravel(), pos_err.ravel(), brho_err.ravel(), order)
+        if np.isnan(params).any():
+            text_display.setPlainText(f"Not enough rows selected for an order {order} B\u03C1 calibration, insert a 1 into the 'Use' column of at least {order + 1} rows!")
+            return
+
+        # every peak of every tab: position -> B*rho -> excitation energy, the uncertainty comes from the
+        # fit covariance and the position error, carried through the slope of B*rho(excitation)
+        peaks = stack_ragged([tab.model.array[:, 3] for tab in tabs])
+        peak_errs = stack_ragged([tab.model.array[:, 4] for tab in tabs])
+        peak_brho = evaluate_polynomial(params, peaks)
+        peak_brho_err = np.sqrt(polynomial_band(params, pcov, peaks) ** 2 + (polynomial_derivative(params, peaks) * peak_errs) ** 2)
+        peak_excitation = excitation_from_rigidity(masses, beam_energy, charge, angles, peak_brho, target=target)
+        peak_excitation_err = peak_brho_err / np.abs(rigidity_derivative(masses, beam_energy, charge, peak_excitation, angles[:, None], target=target))
+
+        for tab, values, errors in zip(tabs, peak_excitation * 1000, peak_excitation_err * 1000):
+            tab.text_display.setPlainText("B\u03C1 calibrated energies [keV] (row: energy +- uncertainty):")
+            for row in np.nonzero(~np.isnan(values))[0]:
+                tab.text_display.append(f"{row + 1}: {values[row]} +- {errors[row]}")
+
+        figure = input_tab.figure
+        figure.clear()
+        ax = figure.add_subplot(111)
+        for angle, x, y, y_err in zip(angles, pos, brho, brho_err):
+            ax.errorbar(x, y, yerr=y_err, fmt='o', markersize=3, label=f"{angle:g} deg")
+        pos_range = np.linspace(np.nanmin(pos), np.nanmax(pos), 200)
+        ax.plot(pos_range, evaluate_polynomial(params, pos_range), 'k', label=f"Order {order} Polynomial")
+        ax.set_xlabel('Position [Channel]')
+        ax.set_ylabel('B\u03C1 [T m]')
+        ax.legend(fontsize='small')
+        input_tab.canvas.draw()
+        text_display.setPlainText(f"B\u03C1 calibration: [{', '.join(str(p) for p in params)}]\nUncertainties: {np.sqrt(np.diag(pcov))}\nchi2/ndf: {chi2_ndf}")
+        text_display.append("The B\u03C1 calibrated energies of every peak are listed in the angle tabs")
+        if target is not None:
+            text_display.append(f"Corrected for the energy loss in {target[0]} mg/cm\u00B2 of target")
+        if dropped:
+            text_display.append(f"{dropped} selected row(s) left out: their energy is above the reaction threshold"
+                                + (f" or the ejectile energy is outside the ejectile stopping table (up to {target[2].max_energy} MeV)" if target is not None else ""))
+
+    def joint_calibration(self):
+        # One fit of all angle tabs together: every angle keeps its own offset, the higher coefficients
+        # are shared and vary smoothly with angle. Tabs with different polynomial orders get the joint
+        # fit of their order, the results replace the per tab calibration in every angle tab
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        try:
+            angle_order = max(0, int(input_tab.angle_order_input.text()))
+        except ValueError:
+            angle_order = JOINT_ANGLE_ORDER
+        self.hydrate_tabs()
+
+        tab_indices = list(range(1, self.tabwidget.count() - 1))
+        tabs = [self.tabwidget.widget(tab_index) for tab_index in tab_indices]
+        angles = np.array([minAngle + (tab_index - 1) * stepAngle for tab_index in tab_indices])
+        points = [self.calibration_points(tab) for tab in tabs]
+        energy, energy_err, pos, pos_err = (stack_ragged(columns) for columns in zip(*points))
+        no_outliers = np.zeros(pos.shape, dtype=bool)
+
+        orders = np.array([self.poly_order(tab) for tab in tabs])
+        fits = {order: calibration_results(pos, *fit_joint(pos, energy, pos_err, energy_err, order, angles, angle_order), no_outliers)
+                for order in np.unique(np.append(orders, 1))}
+        for i, tab in enumerate(tabs):
+            tab.model.set_flagged([])
+            # written next to the per tab calibration files instead of over them
+            self.draw_calibration(tab, points[i], fits[1][i], fits[orders[i]][i], suffix='_joint')
+            tab.text_display.append(f"Joint fit of {len(tabs)} angles, angle order {angle_order}")
+            tab.calibration_drawn = None # the next Run goes back to the per tab calibration
+        input_tab.text_display.setPlainText(f"Joint calibration of all angle tabs done, chi2/ndf: Linear {fits[1][0]['chi2_ndf']}, Polynomial {', '.join(str(fits[order][0]['chi2_ndf']) for order in np.unique(orders))}")
+
+    def resample_all_angles(self, mode):
+        # Bootstrap ('bootstrap') or Monte-Carlo ('montecarlo') spread of the linear and polynomial
+        # calibration of every angle tab, all replicas of one model order are solved in one call. Rows
+        # rejected as outliers by the calibration of the tab are left out of its replicas
+        input_tab = self.tabwidget.widget(INPUT_INDEX)
+        try:
+            replicas = max(1, int(input_tab.replicas_input.text()))
+        except ValueError:
+            replicas = RESAMPLE_REPLICAS
+        # a process pool only pays off once the replicas take longer than starting it
+        workers = None if replicas >= RESAMPLE_PARALLEL_REPLICAS else 1
+        self.hydrate_tabs()
+        fits = self.run_calibration(list(range(1, self.tabwidget.count() - 1)))
+
+        tabs = [self.tabwidget.widget(tab_index) for tab_index in range(1, self.tabwidget.count() - 1)]
+        points = [self.calibration_points(tab) for tab in tabs]
+        orders = np.array([self.poly_order(tab) for tab in tabs])
+        results = [[None, None] for tab in tabs]
+        for model, model_orders in enumerate((np.ones_like(orders), orders)):
+            inliers = [~fit[model]['outliers'][:len(columns[0])] for fit, columns in zip(fits, points)]
+            energy, energy_err, pos, pos_err = (stack_ragged([column[keep] for column, keep in zip(columns, inliers)]) for columns in zip(*points))
+            for order in np.unique(model_orders):
+                same = np.nonzero(model_orders == order)[0]
+                samples, interval = resample_calibration(pos[same], energy[same], pos_err[same], energy_err[same], order,
+                                                         replicas, mode, CALIBRATION_RANGE, max_workers=workers)
+                for i, sample, band in zip(same, samples, interval):
+                    results[i][model] = sample, band
+
+        label = 'Bootstrap' if mode == 'bootstrap' else 'Monte-Carlo'
+        for tab, fits in zip(tabs, results):
+            axes = tab.figure.get_axes()
+            if axes:
+                for line in [line for line in axes[0].get_lines() if line.get_gid() == 'resample']:
+                    line.remove()
+            for (sample, band), name, color in zip(fits, ('Linear', 'Polynomial'), ('r', 'b')):
+                if np.isnan(sample).all():
                     continue
+                low, high = np.nanpercentile(sample, [16, 84], axis=0)
+                tab.text_display.append(f"{label} {name} ({replicas} replicas): mean {np.nanmean(sample, axis=0)}, std {np.nanstd(sample, axis=0)}")
+                tab.text_display.append(f"    68% intervals: {', '.join(f'[{l}, {h}]' for l, h in zip(low, high))}")
+                if axes:
+                    axes[0].plot(CALIBRATION_RANGE, band[0], color + '--', linewidth=0.8, gid='resample')
+                    axes[0].plot(CALIBRATION_RANGE, band[1], color + '--', linewidth=0.8, gid='resample')
+            tab.canvas.draw()
+        input_tab.text_display.setPlainText(f"{label} calibration with {replicas} replicas done, see the parameter distributions in each angle tab")
+
+    def calibration_rows(self, tab):
+        # Indices of the rows with a 1 in the "1 = Use" column
+        return np.nonzero(tab.model.array[:, 0] == 1)[0]
+
+    def calibration_points(self, tab):
+        # energy, energy_err, pos, pos_err of the calibration_rows
+        selected = tab.model.array[self.calibration_rows(tab)]
+        return selected[:, 1], selected[:, 2], selected[:, 3], selected[:, 4]
+
+    def poly_order(self, tab):
+        try:
+            return max(1, int(tab.order_input.text()))
+        except ValueError:
+            return POLY_ORDER
+
+    def run_calibration(self, tab_indices):
+        # Linear and polynomial energy calibration of the given angle tabs, all tabs are solved
+        # together in stacked closed-form fits (one per polynomial order and outlier method). Results are
+        # cached by the selected rows, a tab whose rows, order, method and name did not change keeps its plot.
+        # Returns the (linear, poly) fit results of every tab
+        tabs = [self.tabwidget.widget(tab_index) for tab_index in tab_indices]
+        points = [self.calibration_points(tab) for tab in tabs]
+        orders = np.array([self.poly_order(tab) for tab in tabs])
+        methods = np.array([tab.robust_input.currentText() for tab in tabs])
+        keys = [calibration_key(*columns, order, method) for columns, order, method in zip(points, orders, methods)]
+
+        missing = [i for i, key in enumerate(keys) if key not in self.calibration_cache]
+        if missing:
+            energy, energy_err, pos, pos_err = (stack_ragged(columns) for columns in zip(*[points[i] for i in missing]))
+
+            def calibrate(rows, order, method):
+                # errors on both axes: the position errors enter through the slope of each model
+                args = pos[rows], energy[rows], pos_err[rows], energy_err[rows], order
+                if method == 'Huber':
+                    params, pcov, chi2_ndf, sigma, outliers = fit_huber(*args)
+                elif method == 'RANSAC':
+                    params, pcov, chi2_ndf, sigma, outliers = fit_ransac(*args, seed=0)
                 else:
-                    temp.append(i)
-            energy_list = temp
-
-            for i, matching_rows in matched_rows:
-                k = 2
-                l = 0
-                current_table.setItem(i,1, QTableWidgetItem(energy_list[i]))
-                for tab, row in enumerate(matching_rows):
-                    BCI_hit = float(self.tabwidget.widget(0).findChild(QTableWidget).item(l, 1).text())
-                    BCI_scale = float(self.tabwidget.widget(0).findChild(QTableWidget).item(l, 2).text())
-                    table = self.tabwidget.widget(tab + 1).findChild(QTableWidget)
-                    val = table.item(row, 7)
-                    err = table.item(row, 8)
-                    if val is not None:
-                        volume = float(val.text())
-                        err = float(err.text())
-                        x_sec, error = cross_section_calculation(BCI_hit, BCI_scale, targetThickness, molarMass, volume, err)
-                        current_table.setItem(i,k, QTableWidgetItem(str(x_sec)))
-                        current_table.setItem(i,k + 1, QTableWidgetItem(str(error)))
-                    else:
-                        current_table.setItem(i,k, QTableWidgetItem(str(0.0)))
-                        current_table.setItem(i,k + 1, QTableWidgetItem(str(0.0)))
-                    k+=2
-                    l+=1
-            text_display.setPlainText("All possible cross-sections calculated!")
+                    params, pcov, chi2_ndf, sigma = fit_effective_variance(*args)
+                    outliers = np.zeros(sigma.shape, dtype=bool)
+                return calibration_results(pos[rows], params, pcov, chi2_ndf, sigma, outliers)
+
+            linear = [None] * len(missing)
+            poly = [None] * len(missing)
+            missing_orders, missing_methods = orders[missing], methods[missing]
+            for method in np.unique(missing_methods):
+                same = np.nonzero(missing_methods == method)[0]
+                for j, fit in zip(same, calibrate(same, 1, method)):
+                    linear[j] = fit
+                for order in np.unique(missing_orders[same]):
+                    same_order = same[missing_orders[same] == order]
+                    for j, fit in zip(same_order, calibrate(same_order, order, method)):
+                        poly[j] = fit
+            for j, i in enumerate(missing):
+                self.calibration_cache[keys[i]] = (linear[j], poly[j])
+
+        fits = []
+        for tab, columns, key in zip(tabs, points, keys):
+            self.calibration_cache.move_to_end(key)
+            linear, poly = self.calibration_cache[key]
+            fits.append((linear, poly))
+            # rows rejected by the polynomial calibration are highlighted in the table
+            tab.model.set_flagged(self.calibration_rows(tab)[poly['outliers'][:len(columns[0])]])
+            drawn = (key, tab.name_input.text())
+            self.draw_calibration(tab, columns, linear, poly, redraw=tab.calibration_drawn != drawn)
+            tab.calibration_drawn = drawn
+        while len(self.calibration_cache) > CALIBRATION_CACHE_SIZE:
+            self.calibration_cache.popitem(last=False)
+        return fits
+
+    def draw_calibration(self, tab, points, linear, poly, redraw=True, suffix=''):
+        # linear and poly are the fit results of this tab, see FIT_KEYS. Without redraw only the
+        # text output is refreshed and the figure is left as it is. suffix is added to the names of
+        # the saved figure and calibration file
+        figure = tab.figure
+        text_display = tab.text_display
+        name = tab.name_input.text()
+        energy, energy_err, pos, pos_err = points
+
+        order = len(poly['params']) - 1
+        if np.isnan(poly['params']).any() or np.isnan(linear['params']).any():
+            text_display.setPlainText(f"Not enough rows selected for an order {order} calibration, insert a 1 into the 'Use' column of at least {order + 1} rows!")
+            figure.clear()
+            tab.canvas.draw()
+            return
+        poly_label = '2nd Order Polynomial' if order == 2 else f'Order {order} Polynomial'
+
+        slope, intercept = linear['params']
+        text_display.setPlainText(f"Linear: [0, {slope}, {intercept}]\nPolynomial: [{', '.join(str(p) for p in poly['params'])}]")
+        text_display.append(f"Uncertainties: Linear {np.sqrt(np.diag(linear['pcov']))}, Polynomial {np.sqrt(np.diag(poly['pcov']))}")
+        text_display.append(f"chi2/ndf: Linear {linear['chi2_ndf']}, Polynomial {poly['chi2_ndf']}")
+        outliers = poly['outliers'][:len(energy)]
+        if outliers.any() or linear['outliers'].any():
+            text_display.append(f"Rejected as outliers: Linear {int(linear['outliers'].sum())} row(s), Polynomial {int(outliers.sum())} row(s) (highlighted in the table)")
+        if not redraw:
+            return
+        figure.clear()
+
+        # Get the energy calibrated
+        energy_calibrated_linear = evaluate_polynomial(linear['params'], pos)
+        energy_calibrated_poly = evaluate_polynomial(poly['params'], pos)
+        
+        #0-7 MeV Range
+        pos_range = CALIBRATION_RANGE
+        Total_energy_calibrated_linear = evaluate_polynomial(linear['params'], pos_range)
+        Total_energy_calibrated_poly = evaluate_polynomial(poly['params'], pos_range)
+
+        # Get the residuals
+        residuals_linear = energy - energy_calibrated_linear
+        residuals_poly = energy - energy_calibrated_poly
+
+        # Plot energy vs position
+        ax1 = figure.add_subplot(211)        
+        ax1.errorbar(pos, energy, xerr=pos_err, yerr=energy_err, fmt='ko', label='Data')
+        if outliers.any():
+            ax1.plot(pos[outliers], energy[outliers], 'mx', markersize=12, label='Outliers')
+        ax1.plot(pos_range, Total_energy_calibrated_linear,'r', label='Linear')
+        ax1.plot(pos_range, Total_energy_calibrated_poly,'b', label=poly_label)
+        ax1.fill_between(pos_range, Total_energy_calibrated_linear - linear['band'], Total_energy_calibrated_linear + linear['band'], color='r', alpha=0.2)
+        ax1.fill_between(pos_range, Total_energy_calibrated_poly - poly['band'], Total_energy_calibrated_poly + poly['band'], color='b', alpha=0.2)
+        ax1.set_xlabel('Position [Channel]')
+        ax1.set_ylabel('Energy [keV]')
+        ax1.set_title(f"{name}")
+        ax1.legend()
+
+        # Plot residuals
+        ax2 = figure.add_subplot(212)        
+        ax2.plot(energy, np.zeros(len(energy)),'k')
+        ax2.errorbar(energy, residuals_linear, yerr=linear['sigma'][:len(energy)], fmt='ro', label='Linear', capsize=4)
+        ax2.errorbar(energy, residuals_poly, yerr=poly['sigma'][:len(energy)], fmt='bo', label=poly_label, capsize=4)
+        ax2.set_xlabel('Energy [keV]')
+        ax2.set_ylabel('Residuals')
+        ax2.legend()
+
+        figure.subplots_adjust(top=0.95, bottom=0.05)
+
+        if name:
+            root, extension = os.path.splitext(name)
+            figure.savefig(root + suffix + extension)
+            save_calibration(name + suffix, pos, linear, poly)
+            text_display.append(f"Calibration written to {name}{suffix}_calibration.txt")
+        tab.canvas.draw()
 
-        canvas.draw()
     def clear_plots(self):
         current_tab_index = self.tabwidget.currentIndex()
         current_tab = self.tabwidget.widget(current_tab_index)
@@ -861,7 +1682,6 @@ class MainWindow(QMainWindow):
     def plot_wEnergyResiduals(self):
         current_tab_index = self.tabwidget.currentIndex()
         current_tab = self.tabwidget.widget(current_tab_index)
-        current_table = current_tab.table
         canvas = current_tab.canvas
         figure = current_tab.figure
         text_display = current_tab.text_display
@@ -874,7 +1694,8 @@ class MainWindow(QMainWindow):
         figure.clear()
         canvas.draw()
 
-        data = get_table_data(current_table)
+        data = get_table_data(current_tab.model)
+        self.hydrate_tabs()
         angles = [15,20,25,30,35,40,45,50,55,60]
         cross_sections_list = []
         error_list = []
@@ -895,23 +1716,15 @@ class MainWindow(QMainWindow):
                             err.append(value)
                 cross_sections_list.append(x_sec)
                 error_list.append(err)
+        angle_list, cross_sections_list, error_list, angle_label = self.frame_angles(excited_state_list, cross_sections_list, error_list, angles, text_display)
+        # measured position of every state in every angle tab, nan where the state is not found
+        angle_data = [self.tabwidget.widget(tab).model.array for tab in range(1, self.tabwidget.count() - 1)]
+        matches = match_states_across(excited_state_list, [data[:, 1] for data in angle_data], self.match_tolerance())
         exp_energies = []
         exp_energies_err = []
-        for excited_state in excited_state_list:
-            temp_energy = []
-            temp_err = []
-            for tab in range(1,self.tabwidget.count() - 1):
-                table = self.tabwidget.widget(tab).findChild(QTableWidget)
-                data = get_table_data(table)
-                for i, row in enumerate(data):
-                    if data[i][1] == excited_state:
-                        for j, value in enumerate(row):
-                            if j == 3:
-                                temp_energy.append(value)
-                            if j == 4:
-                                temp_err.append(value)
-            exp_energies.append(temp_energy)
-            exp_energies_err.append(temp_err)
+        for state_rows in matches:
+            exp_energies.append([data[row, 3] if row >= 0 else np.nan for data, row in zip(angle_data, state_rows)])
+            exp_energies_err.append([data[row, 4] if row >= 0 else np.nan for data, row in zip(angle_data, state_rows)])
         miny=0.01
         maxy=1
         if len(excited_state_list) == 0:
@@ -928,16 +1741,16 @@ class MainWindow(QMainWindow):
             ax.figure.add_axes(ax2)
             figure.add_axes(ax)
             
-            ax.errorbar(angles, cross_sections_list[0], yerr=error_list[0], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
+            ax.errorbar(angle_list[0], cross_sections_list[0], yerr=error_list[0], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
             ax.set_ylabel(r'Cross-Section [$\frac{mb}{sr}$]')
             ax.set_title(f"{excited_state_list[0]} keV")
             ax.set_yscale("log")
             ax.legend()
 
-            ax2.errorbar(angles, exp_energies[0], exp_energies_err[0], color='green', fmt='^', ecolor='#CEB888', markersize=4, capsize=2.0)
-            ax2.hlines(excited_state_list[0], 15,60,colors='b', label='NNDC Energy')
+            ax2.errorbar(angle_list[0], exp_energies[0], exp_energies_err[0], color='green', fmt='^', ecolor='#CEB888', markersize=4, capsize=2.0)
+            ax2.hlines(excited_state_list[0], np.nanmin(angle_list[0]), np.nanmax(angle_list[0]),colors='b', label='NNDC Energy')
             ax2.grid(True)
-            ax2.set_xlabel(r'Lab Angle [$\Theta_{lab}$]')
+            ax2.set_xlabel(angle_label)
             ax.set_xticks([])
             ax.minorticks_on()
             ax.set_title(f"{excited_state_list[0]} keV")
@@ -965,15 +1778,15 @@ class MainWindow(QMainWindow):
             ax.figure.add_axes(ax2)
             figure.add_axes(ax)
 
-            ax.errorbar(angles, cross_sections_list[0], yerr=error_list[0], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
+            ax.errorbar(angle_list[0], cross_sections_list[0], yerr=error_list[0], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
             ax.set_ylabel(r'Cross-Section [$\frac{mb}{sr}$]')
             ax.set_title(f"{excited_state_list[0]} keV")
             ax.set_yscale("log")
             ax.legend()
-            ax2.errorbar(angles, exp_energies[0], exp_energies_err[0], color='green', fmt='^', ecolor='#CEB888', markersize=4, capsize=2.0)
-            ax2.hlines(excited_state_list[0], 15,60,colors='b', label='NNDC Energy')
+            ax2.errorbar(angle_list[0], exp_energies[0], exp_energies_err[0], color='green', fmt='^', ecolor='#CEB888', markersize=4, capsize=2.0)
+            ax2.hlines(excited_state_list[0], np.nanmin(angle_list[0]), np.nanmax(angle_list[0]),colors='b', label='NNDC Energy')
             ax2.grid(True)
-            ax2.set_xlabel(r'Lab Angle [$\Theta_{lab}$]')
+            ax2.set_xlabel(angle_label)
             ax.set_xticks([])
             ax.minorticks_on()
             ax.set_title(f"{excited_state_list[0]} keV")
@@ -990,16 +1803,16 @@ class MainWindow(QMainWindow):
             ax.figure.add_axes(ax2)
             figure.add_axes(ax)
 
-            ax.errorbar(angles, cross_sections_list[1], yerr=error_list[1], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
+            ax.errorbar(angle_list[1], cross_sections_list[1], yerr=error_list[1], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
             ax.set_ylabel(r'Cross-Section [$\frac{mb}{sr}$]')
             ax.set_title(f"{excited_state_list[1]} keV")
             ax.set_yscale("log")
             ax.legend()
 
-            ax2.errorbar(angles, exp_energies[1], exp_energies_err[1], color='green', fmt='^', ecolor='#CEB888', markersize=4, capsize=2.0)
-            ax2.hlines(excited_state_list[1], 15,60,colors='b', label='NNDC Energy')
+            ax2.errorbar(angle_list[1], exp_energies[1], exp_energies_err[1], color='green', fmt='^', ecolor='#CEB888', markersize=4, capsize=2.0)
+            ax2.hlines(excited_state_list[1], np.nanmin(angle_list[1]), np.nanmax(angle_list[1]),colors='b', label='NNDC Energy')
             ax2.grid(True)
-            ax2.set_xlabel(r'Lab Angle [$\Theta_{lab}$]')
+            ax2.set_xlabel(angle_label)
             ax.set_xticks([])
             ax.minorticks_on()
             ax.set_title(f"{excited_state_list[1]} keV")
@@ -1033,16 +1846,16 @@ class MainWindow(QMainWindow):
                     ax.figure.add_axes(ax2)
                     figure.add_axes(ax)
 
-                    ax.errorbar(angles, cross_sections_list[i], yerr=error_list[i], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
+                    ax.errorbar(angle_list[i], cross_sections_list[i], yerr=error_list[i], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
                     ax.set_ylabel(r'Cross-Section [$\frac{mb}{sr}$]')
                     ax.set_title(f"{excited_state_list[i]} keV")
                     ax.set_yscale("log")
                     ax.legend()
 
-                    ax2.errorbar(angles, exp_energies[i], exp_energies_err[i], color='green', fmt='^', ecolor='#CEB888', markersize=4, capsize=2.0)
-                    ax2.hlines(excited_state_list[i], 15,60,colors='b', label='NNDC Energy')
+                    ax2.errorbar(angle_list[i], exp_energies[i], exp_energies_err[i], color='green', fmt='^', ecolor='#CEB888', markersize=4, capsize=2.0)
+                    ax2.hlines(excited_state_list[i], np.nanmin(angle_list[i]), np.nanmax(angle_list[i]),colors='b', label='NNDC Energy')
                     ax2.grid(True)
-                    ax2.set_xlabel(r'Lab Angle [$\Theta_{lab}$]')
+                    ax2.set_xlabel(angle_label)
                     ax.set_xticks([])
                     ax.minorticks_on()
                     ax.set_title(f"{excited_state_list[i]} keV")
@@ -1070,7 +1883,6 @@ class MainWindow(QMainWindow):
         """
         current_tab_index = self.tabwidget.currentIndex()
         current_tab = self.tabwidget.widget(current_tab_index)
-        current_table = current_tab.table
         canvas = current_tab.canvas
         figure = current_tab.figure
         text_display = current_tab.text_display
@@ -1082,7 +1894,7 @@ class MainWindow(QMainWindow):
         name = name_input.text()
 
         # Get data from table
-        data = get_table_data(current_table)
+        data = get_table_data(current_tab.model)
         figure.clear()
         canvas.draw()
         angles = [15,20,25,30,35,40,45,50,55,60]
@@ -1105,6 +1917,7 @@ class MainWindow(QMainWindow):
                             err.append(value)
                 cross_sections_list.append(x_sec)
                 error_list.append(err)
+        angle_list, cross_sections_list, error_list, angle_label = self.frame_angles(excited_state_list, cross_sections_list, error_list, angles, text_display)
         miny=0.01
         maxy=1
         
@@ -1117,8 +1930,8 @@ class MainWindow(QMainWindow):
             figure.set_size_inches(fig_width, fig_height)
             figure.subplots_adjust(hspace=0.375, left=0.15, right = 0.795, top=0.920, bottom=0.330)
             total_height = 2.0 + fig_height
-            ax.errorbar(angles, cross_sections_list[0], yerr=error_list[0], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
-            ax.set_xlabel(r'Lab Angle [$\Theta_{lab}$]')
+            ax.errorbar(angle_list[0], cross_sections_list[0], yerr=error_list[0], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
+            ax.set_xlabel(angle_label)
             ax.set_ylabel(r'Cross-Section [$\frac{mb}{sr}$]')
             ax.set_title(f"{excited_state_list[0]} keV")
             ax.set_yscale("log")
@@ -1141,8 +1954,8 @@ class MainWindow(QMainWindow):
             figure.subplots_adjust(hspace=0.375, left=0.125, right = 0.625, top=0.920, bottom=0.080)
             total_height = 2 * fig_height + 0.375
             ax = figure.add_subplot(211)
-            ax.errorbar(angles, cross_sections_list[0], yerr=error_list[0], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
-            ax.set_xlabel(r'Lab Angle [$\Theta_{lab}$]')
+            ax.errorbar(angle_list[0], cross_sections_list[0], yerr=error_list[0], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
+            ax.set_xlabel(angle_label)
             ax.set_ylabel(r'Cross-Section [$\frac{mb}{sr}$]')
             ax.set_title(f"{excited_state_list[0]} keV")
             ax.set_yscale("log")
@@ -1154,8 +1967,8 @@ class MainWindow(QMainWindow):
                     maxy = 10
             ax.set_ylim(miny, maxy)
             ax1 = figure.add_subplot(212)
-            ax1.errorbar(angles, cross_sections_list[1], yerr=error_list[1], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
-            ax1.set_xlabel(r'Lab Angle [$\Theta_{lab}$]')
+            ax1.errorbar(angle_list[1], cross_sections_list[1], yerr=error_list[1], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
+            ax1.set_xlabel(angle_label)
             ax1.set_ylabel(r'Cross-Section [$\frac{mb}{sr}$]')
             ax1.set_title(f"{excited_state_list[1]} keV")
             ax1.set_yscale("log")
@@ -1185,8 +1998,8 @@ class MainWindow(QMainWindow):
                 counter = 0
                 for i in range(len(cross_sections_list)):
                     ax = figure.add_subplot(plot_num)
-                    ax.errorbar(angles, cross_sections_list[i], yerr=error_list[i], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
-                    ax.set_xlabel(r'Lab Angle [$\Theta_{lab}$]')
+                    ax.errorbar(angle_list[i], cross_sections_list[i], yerr=error_list[i], color='black', fmt='x', ecolor='red', capsize=2.0, label='Data')
+                    ax.set_xlabel(angle_label)
                     ax.set_ylabel(r'Cross-Section [$\frac{mb}{sr}$]')
                     ax.set_title(f"{excited_state_list[i]} keV")
                     ax.set_yscale("log")
@@ -1211,28 +2024,17 @@ class MainWindow(QMainWindow):
     def save(self):
         current_tab_index = self.tabwidget.currentIndex()
         current_tab = self.tabwidget.widget(current_tab_index)
-        table = current_tab.table
         name_input = current_tab.name_input
 
 
         name = name_input.text()
-        data = []
-        for i in range(table.rowCount()):
-            row = []
-            for j in range(table.columnCount()):
-                item = table.item(i, j)
-                if item is not None:
-                    row.append(float(item.text()))
-                else:
-                    row.append(np.nan)
-            data.append(row)
-        save_data(data, name)
+        save_data(current_tab.model.array, name)
 
     def load(self):
 
         current_tab_index = self.tabwidget.currentIndex()
         current_tab = self.tabwidget.widget(current_tab_index)
-        table = current_tab.table
+        model = current_tab.model
         name_input = current_tab.name_input
         text_display = current_tab.text_display
 
@@ -1256,15 +2058,14 @@ class MainWindow(QMainWindow):
                             BCI_data.append(line.split('\t'))
                         i+=1
 
-                table.setRowCount(0)
-                table.setRowCount(len(BCI_data))
                 molarMass_input.setText(str(targetinfo[0][0]))
                 targetThickness_input.setText(str(targetinfo[0][1]))
 
+                BCI_array = np.full((len(BCI_data), model.columnCount()), np.nan)
                 for i, row in enumerate(BCI_data):
-                    for j, value in enumerate(row):
-                        item = QTableWidgetItem(str(value))
-                        table.setItem(i,j,item)
+                    for j, value in enumerate(row[:model.columnCount()]):
+                        BCI_array[i, j] = float(value)
+                fill_table(model, BCI_array)
                 text_display.setPlainText('Input file loaded sucessfully!')
 
             else:
@@ -1272,111 +2073,227 @@ class MainWindow(QMainWindow):
         
         else:
             file_extension = os.path.splitext(name)[1]
-            if file_extension == '.xml':
-                csvfile, cal_flag = general_xml(name,name)
-            elif file_extension == '.fit':
-                csvfile, cal_flag = general_xml(name,name)
+            if file_extension not in ('.xml', '.fit'):
+                text_display.setPlainText(f'Failed to load file: {name}')
+                return
+            peaks, cal_flag = self.fit_cache.read(name)
 
             if cal_flag:
                 text_display.setPlainText("Calibrated data set, position & uncertainty in [keV]")
             else:
                 text_display.setPlainText("Uncalibrated data set, position & uncertainty in [channel]")
-            data = load_data(csvfile)
-            os.remove(csvfile)
+            text_display.append(self.fit_cache.stats())
 
             # Clear the table before loading new data
-            table.setRowCount(0)
-            table.setRowCount(len(data))
-
-            for i, row in enumerate(data):
-                for j, value in enumerate(row):
-                    item = QTableWidgetItem(str(value))
-                    table.setItem(i, j, item)
+            fill_table(model, fit_to_table(peaks))
     
     def save_to_file(self):
         options = QFileDialog.Options()
         options |= QFileDialog.ReadOnly
-        file_name, _ = QFileDialog.getSaveFileName(self, "Save File", "", "JSON Files (*.json);;All Files (*)", options=options)
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save File", "", "SPS Session (*.sps);;All Files (*)", options=options)
         if file_name:
-            data = {}
-            for tab_index in range(self.tabwidget.count()):
-                tab = self.tabwidget.widget(tab_index)
-                table = tab.findChild(QTableWidget)
-                if table:
-                    table_data = []
-                    for row in range(table.rowCount()):
-                        row_data = []
-                        for col in range(table.columnCount()):
-                            item = table.item(row, col)
-                            if item:
-                                row_data.append(item.text())
-                            else:
-                                row_data.append('')
-                        table_data.append(row_data)
-                    data[f"tab{tab_index}"] = table_data
-
-                # Add any QLineEdit objects to the dictionary
-                line_edit_data = {}
-                for line_edit in tab.findChildren(QLineEdit):
-                    line_edit_name = line_edit.objectName()
-                    line_edit_text = line_edit.text()
-                    line_edit_data[line_edit_name] = line_edit_text
-                if line_edit_data:
-                    data[f"lineedits_{tab_index}"] = line_edit_data
-
-            file = QFile(file_name)
-            if file.open(QFile.WriteOnly | QFile.Text):
-                stream = QTextStream(file)
-                stream << json.dumps(data)
-                file.close()
+            if not os.path.splitext(file_name)[1]:
+                file_name += '.sps'
+            # the pending tabs may point into the very file that is about to be replaced
+            self.hydrate_tabs()
+            write_session(file_name, self.session_tabs())
+
+    def session_tabs(self):
+        # Session contents for write_session, tabs still pending from a lazy restore only point at
+        # their session file and are copied from it by the writer, they are not filled in first
+        tabs = {}
+        for tab_index in range(self.tabwidget.count()):
+            tab = self.tabwidget.widget(tab_index)
+            entry = {}
+            if tab_index in self.pending_tabs:
+                entry['source'] = self.pending_tabs[tab_index]
+            else:
+                entry['data'] = tab.model.array.copy()
+            entry['lineedits'] = {line_edit.objectName(): line_edit.text() for line_edit in tab.findChildren(QLineEdit)}
+            entry['comboboxes'] = {combo_box.objectName(): combo_box.currentText() for combo_box in tab.findChildren(QComboBox)}
+            tabs[tab_index] = entry
+        return tabs
+
+    def connect_journal(self, tab_index):
+        tab = self.tabwidget.widget(tab_index)
+        model = tab.model
+        model.dataChanged.connect(lambda top_left, bottom_right, roles=None: self.journal_data_changed(tab_index, top_left, bottom_right))
+        model.rowsInserted.connect(lambda parent, first, last: self.journal_append({'op': 'insert', 'tab': tab_index, 'row': first, 'count': last - first + 1}))
+        model.rowsRemoved.connect(lambda parent, first, last: self.journal_append({'op': 'remove', 'tab': tab_index, 'row': first, 'count': last - first + 1}))
+        model.modelReset.connect(lambda: self.journal_append({'op': 'table', 'tab': tab_index, 'data': model.array.tolist()}))
+        for line_edit in tab.findChildren(QLineEdit):
+            line_edit.textChanged.connect(lambda text, name=line_edit.objectName(): self.journal_append({'op': 'line', 'tab': tab_index, 'name': name, 'text': text}))
+        for combo_box in tab.findChildren(QComboBox):
+            combo_box.currentTextChanged.connect(lambda text, name=combo_box.objectName(): self.journal_append({'op': 'combo', 'tab': tab_index, 'name': name, 'text': text}))
+
+    def journal_data_changed(self, tab_index, top_left, bottom_right):
+        # Changed blocks of cells are collected and written as one record per tab once control
+        # returns to the event loop
+        if self.journal_paused:
+            return
+        if not self.journal_cells:
+            QTimer.singleShot(0, self.flush_journal_cells)
+        row, col = top_left.row(), top_left.column()
+        block = self.tabwidget.widget(tab_index).model.array[row:bottom_right.row() + 1, col:bottom_right.column() + 1]
+        self.journal_cells.append((tab_index, row, col, block.tolist()))
+
+    def flush_journal_cells(self):
+        blocks = {}
+        for tab_index, row, col, block in self.journal_cells:
+            blocks.setdefault(tab_index, []).append([row, col, block])
+        self.journal_cells = []
+        self.journal_error = None # last autosave failure shown in the status bar
+        for tab_index, tab_blocks in blocks.items():
+            self.journal.append({'op': 'cells', 'tab': tab_index, 'blocks': tab_blocks})
+        self.show_journal_error()
+
+    def journal_append(self, record):
+        if self.journal_paused:
+            return
+        self.flush_journal_cells()
+        self.journal.append(record)
+
+    def compact_journal(self):
+        if self.journal.records >= JOURNAL_COMPACT_RECORDS:
+            self.flush_journal_cells()
+            self.journal.compact(self.session_tabs())
+        self.show_journal_error()
+
+    def show_journal_error(self):
+        # Failures of the autosave writer thread stay in the status bar until the next one
+        if self.journal.error is not None and self.journal.error != self.journal_error:
+            self.journal_error = self.journal.error
+            self.statusBar().showMessage(self.journal_error)
+
+    def recover_autosave(self):
+        # Offers to restore the work of every session that crashed: loads its last snapshot and
+        # replays the journal records written after it
+        for snapshot, records, mtime in self.journal.recoveries():
+            when = time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))
+            answer = QMessageBox.question(self, "Recover Session", f"A session last saved at {when} did not close properly. Recover its unsaved work?")
+            if answer != QMessageBox.Yes:
+                continue
+            self.journal_paused = True
+            if snapshot is not None:
+                self.pending_tabs = {}
+                self.load_session(snapshot)
+                self.hydrate_tabs()
+            for record in records:
+                self.replay_journal_record(record)
+            self.journal_paused = False
+            self.journal.compact(self.session_tabs())
+        self.journal.discard_recovery()
+
+    def replay_journal_record(self, record):
+        tab = self.tabwidget.widget(record['tab'])
+        model = tab.model
+        op = record['op']
+        if op == 'cells':
+            for row, col, block in record['blocks']:
+                block = np.array(block, dtype=np.float64)
+                model.set_values(np.arange(row, row + block.shape[0]), np.arange(col, col + block.shape[1]), block)
+        elif op == 'table':
+            fill_table(model, np.array(record['data'], dtype=np.float64).reshape(-1, model.columnCount()))
+        elif op == 'insert':
+            model.insertRows(record['row'], record['count'])
+        elif op == 'remove':
+            model.removeRows(record['row'], record['count'])
+        elif op == 'line':
+            line_edit = tab.findChild(QLineEdit, record['name'])
+            if line_edit:
+                line_edit.setText(record['text'])
+        elif op == 'combo':
+            combo_box = tab.findChild(QComboBox, record['name'])
+            if combo_box:
+                combo_box.setCurrentText(record['text'])
+
+    def closeEvent(self, event):
+        self.journal.close()
+        super().closeEvent(event)
 
     def load_from_file(self):
         options = QFileDialog.Options()
         options |= QFileDialog.ReadOnly
-        file_name, _ = QFileDialog.getOpenFileName(self, "Open File", "", "JSON Files (*.json);;All Files (*)", options=options)
+        file_name, _ = QFileDialog.getOpenFileName(self, "Open File", "", "Sessions (*.sps *.json);;All Files (*)", options=options)
         if file_name:
-            file = QFile(file_name)
-            if file.open(QFile.ReadOnly | QFile.Text):
-                stream = QTextStream(file)
-                data = json.loads(stream.readAll())
-                file.close()
-                j=0
-                for tab_index, table_data in data.items(): 
-                    if (tab_index.startswith("tab")):
-                        tab_index = int(tab_index[3:])
-                        tab = self.tabwidget.widget(tab_index)
-
-                        # Load the data for any QTableWidget
-                        table = tab.findChild(QTableWidget)
-                        if table:
-                            num_rows = len(table_data)
-                            num_cols = len(table_data[0])
-                            table.setRowCount(num_rows)
-                            table.setColumnCount(num_cols)
-                            for row_index, row_data in enumerate(table_data):
-                                for col_index, item_data in enumerate(row_data):
-                                    if item_data == '':
-                                        table.setItem(row_index, col_index, None)
-                                    else:
-                                        item = QTableWidgetItem(item_data)
-                                        table.setItem(row_index, col_index, item)
-
-                    # Load the data for any QLineEdit objects
-                    elif (tab_index.startswith("lineedits_")):
-                        tab_index = int(tab_index[10:])
-                        tab = self.tabwidget.widget(tab_index)
-                        line_edit_data = data.get(f"lineedits_{tab_index}")
-                        if line_edit_data:
-                            for line_edit_name, line_edit_text in line_edit_data.items():
-                                line_edit = tab.findChild(QLineEdit, line_edit_name)
-                                if line_edit:
-                                    line_edit.setText(line_edit_text)
+            self.pending_tabs = {}
+            if is_session_file(file_name):
+                self.load_session(file_name)
+            else:
+                self.load_json_session(file_name)
+            self.flush_journal_cells()
+            self.journal.compact(self.session_tabs())
+
+    def load_session(self, file_name):
+        # Only the visible tab is filled right away, the other tables are read from the session
+        # file when their tab is first opened or a computation needs them (see hydrate_tabs)
+        header = read_session_header(file_name)
+        for tab_index, entry in header['tabs'].items():
+            tab = self.tabwidget.widget(tab_index)
+            for line_edit_name, line_edit_text in entry['lineedits'].items():
+                line_edit = tab.findChild(QLineEdit, line_edit_name)
+                if line_edit:
+                    line_edit.setText(line_edit_text)
+            for combo_box_name, combo_box_text in entry.get('comboboxes', {}).items():
+                combo_box = tab.findChild(QComboBox, combo_box_name)
+                if combo_box:
+                    combo_box.setCurrentText(combo_box_text)
+            if 'offset' in entry:
+                self.pending_tabs[tab_index] = (file_name, header)
+        self.hydrate_tabs([self.tabwidget.currentIndex()])
+
+    def hydrate_tabs(self, indices=None):
+        # Fills the given tabs (all of them if None) that are still waiting on a lazily loaded session
+        if indices is None:
+            indices = list(self.pending_tabs)
+        for tab_index in indices:
+            if tab_index not in self.pending_tabs:
+                continue
+            file_name, header = self.pending_tabs.pop(tab_index)
+            # already part of the autosave snapshot taken when the session was opened
+            journal_paused, self.journal_paused = self.journal_paused, True
+            fill_table(self.tabwidget.widget(tab_index).model, read_session_tab(file_name, header, tab_index))
+            self.journal_paused = journal_paused
+
+    def load_json_session(self, file_name):
+        # Sessions saved before the binary format was introduced
+        file = QFile(file_name)
+        if file.open(QFile.ReadOnly | QFile.Text):
+            stream = QTextStream(file)
+            data = json.loads(stream.readAll())
+            file.close()
+            for tab_index, table_data in data.items():
+                if (tab_index.startswith("tab")):
+                    tab_index = int(tab_index[3:])
+                    tab = self.tabwidget.widget(tab_index)
+
+                    # Load the data for the table, cells were stored as text
+                    table_array = np.full((len(table_data), tab.model.columnCount()), np.nan)
+                    for row_index, row_data in enumerate(table_data):
+                        for col_index, item_data in enumerate(row_data[:tab.model.columnCount()]):
+                            try:
+                                table_array[row_index, col_index] = float(item_data)
+                            except ValueError:
+                                pass
+                    fill_table(tab.model, table_array)
+
+                # Load the data for any QLineEdit objects
+                elif (tab_index.startswith("lineedits_")):
+                    tab_index = int(tab_index[10:])
+                    tab = self.tabwidget.widget(tab_index)
+                    line_edit_data = data.get(f"lineedits_{tab_index}")
+                    if line_edit_data:
+                        for line_edit_name, line_edit_text in line_edit_data.items():
+                            line_edit = tab.findChild(QLineEdit, line_edit_name)
+                            if line_edit:
+                                line_edit.setText(line_edit_text)
 
         
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
+    window.recover_autosave()
     sys.exit(app.exec_())
 
 
@@ -0,0 +1,272 @@
+import os
+import hashlib
+import numpy as np
+from parallel import pool_map
+
+# Energy calibration of the focal-plane position. Polynomials are stored with the highest power
+# first (same convention as np.polyval). All functions take stacked inputs: a leading axis per
+# angle tab, with nan padding where an angle has fewer calibration points than the others
+REPLICA_CHUNK = 2000 # replicas fitted together by resample_calibration
+BAND_CHUNK_BYTES = 32 * 1024 * 1024 # replica curves evaluated and sorted at a time by replica_band
+
+def stack_ragged(arrays):
+    # Stacks 1D arrays of different lengths into a (len(arrays), longest) array padded with nan
+    arrays = [np.asarray(a, dtype=np.float64) for a in arrays]
+    stacked = np.full((len(arrays), max([len(a) for a in arrays], default=0)), np.nan)
+    for i, a in enumerate(arrays):
+        stacked[i, :len(a)] = a
+    return stacked
+
+def polynomial_design(x, order):
+    # (..., n, order+1) matrix of x**order ... x**0
+    return np.asarray(x, dtype=np.float64)[..., None] ** np.arange(order, -1, -1)
+
+def evaluate_polynomial(params, x):
+    # params (..., order+1) against x (..., n), e.g. one parameter set per angle on a shared grid
+    params = np.asarray(params, dtype=np.float64)
+    return (polynomial_design(x, params.shape[-1] - 1) @ params[..., None])[..., 0]
+
+def fit_linear(design, y, sigma):
+    # Weighted linear least squares y ~ design @ params solved in closed form through a QR decomposition,
+    # design is (..., n, n_params). Points with a nan (or sigma <= 0) are left out. Returns params
+    # (..., n_params), their covariance taken from the given sigmas (like absolute_sigma=True) and
+    # chi2/ndf. Fits with fewer points than parameters come back as nan
+    design, y, sigma = np.asarray(design, dtype=np.float64), np.asarray(y, dtype=np.float64), np.asarray(sigma, dtype=np.float64)
+    n_params = design.shape[-1]
+    if design.shape[-2] < n_params:
+        pad = [(0, 0)] * (y.ndim - 1) + [(0, n_params - design.shape[-2])]
+        design = np.pad(design, pad + [(0, 0)], constant_values=np.nan)
+        y, sigma = (np.pad(a, pad, constant_values=np.nan) for a in (y, sigma))
+
+    valid = ~(np.isnan(design).any(axis=-1) | np.isnan(y) | np.isnan(sigma)) & (sigma > 0)
+    weight = np.where(valid, 1.0 / np.where(valid, sigma, 1.0), 0.0)
+    A = np.where(valid[..., None], design, 0.0) * weight[..., None]
+    b = np.where(valid, y, 0.0) * weight
+
+    Q, R = np.linalg.qr(A)
+    R_inv = np.linalg.pinv(R)
+    params = (R_inv @ (np.swapaxes(Q, -1, -2) @ b[..., None]))[..., 0]
+    pcov = R_inv @ np.swapaxes(R_inv, -1, -2)
+
+    chi2 = np.sum(((A @ params[..., None])[..., 0] - b) ** 2, axis=-1)
+    ndf = valid.sum(axis=-1) - n_params
+    chi2_ndf = np.where(ndf > 0, chi2 / np.maximum(ndf, 1), np.nan)
+
+    underdetermined = valid.sum(axis=-1) < n_params
+    params = np.where(underdetermined[..., None], np.nan, params)
+    pcov = np.where(underdetermined[..., None, None], np.nan, pcov)
+    return params, pcov, chi2_ndf
+
+def fit_polynomial(x, y, sigma, order):
+    # fit_linear of a polynomial (highest power first), x, y and sigma are broadcast against each other
+    x, y, sigma = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (x, y, sigma)))
+    return fit_linear(polynomial_design(x, order), y, sigma)
+
+def polynomial_derivative(params, x):
+    # d/dx of the polynomial params (..., order+1) at x (..., n)
+    params = np.asarray(params, dtype=np.float64)
+    order = params.shape[-1] - 1
+    if order == 0:
+        return np.zeros(np.broadcast_shapes(params.shape[:-1], np.shape(x)))
+    return evaluate_polynomial(params[..., :-1] * np.arange(order, 0, -1), x)
+
+def effective_sigma(params, x, x_err, y_err):
+    # Position errors folded through the slope of the calibration: sigma^2 = y_err^2 + (f'(x) x_err)^2
+    return np.sqrt(y_err ** 2 + (polynomial_derivative(params, x) * x_err) ** 2)
+
+def fit_effective_variance(x, y, x_err, y_err, order, max_iter=20, rtol=1e-10):
+    # Polynomial fit with errors on both axes (effective variance method). Starts from an unweighted
+    # fit and refits with effective_sigma of the previous parameters until no parameter of any of the
+    # stacked fits moves by more than rtol. Returns params, pcov, chi2/ndf like fit_polynomial plus
+    # the effective sigma of every point
+    x, y, x_err, y_err = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (x, y, x_err, y_err)))
+    sigma = np.where(np.isnan(x_err) | np.isnan(y_err), np.nan, 1.0)
+    params, pcov, chi2_ndf = fit_polynomial(x, y, sigma, order)
+    for _ in range(max_iter):
+        sigma = effective_sigma(params, x, x_err, y_err)
+        new_params, pcov, chi2_ndf = fit_polynomial(x, y, sigma, order)
+        step = np.abs(new_params - params)
+        params = new_params
+        if not (step > rtol * np.maximum(np.abs(params), 1.0)).any():
+            break
+    return params, pcov, chi2_ndf, effective_sigma(params, x, x_err, y_err)
+
+def polynomial_band(params, pcov, x):
+    # 1 sigma uncertainty of the calibrated value at x (..., n) from the full parameter covariance,
+    # J C J^T per point with J the design row of that point
+    J = polynomial_design(x, np.shape(params)[-1] - 1)
+    return np.sqrt(np.einsum('...ni,...ij,...nj->...n', J, pcov, J))
+
+def calibration_key(energy, energy_err, pos, pos_err, order, method=''):
+    # Hash of the selected calibration points, the polynomial order and the fit method,
+    # identical inputs give identical fits
+    digest = hashlib.sha1(f"{int(order)}\0{method}".encode())
+    for column in (energy, energy_err, pos, pos_err):
+        digest.update(np.ascontiguousarray(column, dtype=np.float64).tobytes())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def resample_replicas(x, y, x_err, y_err, sigma, replicas, mode, seed):
+    # Draws (..., replicas, n) copies of the calibration points. 'bootstrap' resamples the valid points
+    # of every fit with replacement (unused slots stay nan), 'montecarlo' shifts every point by
+    # gaussian noise of its x and y errors
+    rng = np.random.default_rng(seed)
+    valid = ~(np.isnan(x) | np.isnan(y) | np.isnan(sigma)) & (sigma > 0)
+    shape = x.shape[:-1] + (replicas, x.shape[-1])
+    if mode == 'montecarlo':
+        x_rep = x[..., None, :] + rng.standard_normal(shape) * np.nan_to_num(x_err)[..., None, :]
+        y_rep = y[..., None, :] + rng.standard_normal(shape) * np.nan_to_num(y_err)[..., None, :]
+        return x_rep, y_rep, np.broadcast_to(sigma[..., None, :], shape)
+
+    # valid points first, then draw among the first count of them
+    order = np.argsort(~valid, axis=-1, kind='stable')
+    x, y, sigma = (np.take_along_axis(a, order, axis=-1) for a in (x, y, sigma))
+    count = valid.sum(axis=-1)[..., None, None]
+    index = np.minimum((rng.random(shape) * count).astype(np.intp), x.shape[-1] - 1)
+    used = np.arange(x.shape[-1]) < count
+    x_rep, y_rep, sigma_rep = (np.where(used, np.take_along_axis(np.broadcast_to(a[..., None, :], shape), index, axis=-1), np.nan) for a in (x, y, sigma))
+    return x_rep, y_rep, sigma_rep
+
+def replica_fits(x, y, x_err, y_err, sigma, order, replicas, mode, seed):
+    # One batched solve for all replicas of all stacked fits, params come back as (..., replicas, order+1).
+    # Bootstrap replicas that drew fewer distinct positions than parameters are nan
+    x_rep, y_rep, sigma_rep = resample_replicas(x, y, x_err, y_err, sigma, replicas, mode, seed)
+    params = fit_polynomial(x_rep, y_rep, sigma_rep, order)[0]
+    sorted_x = np.sort(x_rep, axis=-1)
+    distinct = (~np.isnan(sorted_x[..., :1])).sum(axis=-1) + (np.diff(sorted_x, axis=-1) > 0).sum(axis=-1)
+    return np.where((distinct > order)[..., None], params, np.nan)
+
+def resample_calibration(x, y, x_err, y_err, order, replicas=1000, mode='bootstrap', grid=None, seed=None, max_workers=1):
+    # Bootstrap or Monte-Carlo distribution of the calibration parameters. The effective sigmas of the
+    # nominal fit are kept fixed for the replicas, so every replica is a plain weighted fit and all of
+    # them are solved in batches. With max_workers > 1 the batches are split across a process pool.
+    # Returns the parameter samples (..., replicas, order+1) and, if a grid is given, the 16th and 84th
+    # percentile of the calibrated value on it as (..., 2, len(grid))
+    x, y, x_err, y_err = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (x, y, x_err, y_err)))
+    params, _, _, sigma = fit_effective_variance(x, y, x_err, y_err, order)
+
+    workers = min(replicas, max_workers or os.cpu_count() or 1)
+    # at most REPLICA_CHUNK replicas are solved at once, which bounds the memory of the batched fits
+    shards = np.array_split(np.arange(replicas), max(workers, -(-replicas // REPLICA_CHUNK)))
+    seeds = np.random.SeedSequence(seed).spawn(len(shards))
+    args = [(x, y, x_err, y_err, sigma, order, len(shard), mode, shard_seed) for shard, shard_seed in zip(shards, seeds)]
+    samples = np.concatenate(pool_map(replica_fits, *zip(*args), max_workers=workers), axis=-2)
+
+    if grid is None:
+        return samples, None
+    return samples, replica_band(samples, np.asarray(grid, dtype=np.float64))
+
+def replica_band(samples, grid, quantiles=(0.16, 0.84)):
+    # Quantiles of the calibrated value over the replicas at every grid point as (..., len(quantiles),
+    # len(grid)), nan replicas are skipped. Same as nanpercentile, but one sort per block of grid
+    # points, sized so the curves being sorted stay within BAND_CHUNK_BYTES
+    curves_per_point = int(np.prod(samples.shape[:-1]))
+    chunk = max(1, BAND_CHUNK_BYTES // (16 * max(curves_per_point, 1)))
+    band = np.empty(samples.shape[:-2] + (len(quantiles), len(grid)))
+    for first in range(0, len(grid), chunk):
+        curves = np.sort(evaluate_polynomial(samples, grid[first:first + chunk]), axis=-2)
+        count = (~np.isnan(curves)).sum(axis=-2, keepdims=True)
+        for k, q in enumerate(quantiles):
+            position = q * np.maximum(count - 1, 0)
+            below = np.floor(position).astype(np.intp)
+            above = np.minimum(below + 1, np.maximum(count - 1, 0))
+            fraction = position - below
+            value = (np.take_along_axis(curves, below, axis=-2) * (1 - fraction) + np.take_along_axis(curves, above, axis=-2) * fraction)
+            band[..., k, first:first + chunk] = np.where(count > 0, value, np.nan)[..., 0, :]
+    return band
+
+def clean_fit(x, y, x_err, y_err, order, outliers):
+    # fit_effective_variance without the outlier points, sigma is returned for every point (outliers too)
+    params, pcov, chi2_ndf, _ = fit_effective_variance(np.where(outliers, np.nan, x), y, x_err, y_err, order)
+    return params, pcov, chi2_ndf, effective_sigma(params, x, x_err, y_err), outliers
+
+def fit_huber(x, y, x_err, y_err, order, k=1.345, cut=3.0, max_iter=50, rtol=1e-10):
+    # Iteratively reweighted least squares with Huber weights: points more than k sigma off the curve are
+    # down-weighted by k/|r|. Points still more than cut sigma off afterwards are flagged as outliers and
+    # the returned fit (params, pcov, chi2/ndf, sigma, outliers) is the effective variance fit without them
+    x, y, x_err, y_err = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (x, y, x_err, y_err)))
+    params = fit_effective_variance(x, y, x_err, y_err, order)[0]
+    for _ in range(max_iter):
+        sigma = effective_sigma(params, x, x_err, y_err)
+        r = np.abs(y - evaluate_polynomial(params, x)) / sigma
+        weight = np.where(r > k, k / np.where(r > k, r, 1.0), 1.0)
+        new_params = fit_polynomial(x, y, sigma / np.sqrt(weight), order)[0]
+        step = np.abs(new_params - params)
+        params = new_params
+        if not (step > rtol * np.maximum(np.abs(params), 1.0)).any():
+            break
+    r = np.abs(y - evaluate_polynomial(params, x)) / effective_sigma(params, x, x_err, y_err)
+    return clean_fit(x, y, x_err, y_err, order, r > cut)
+
+def fit_ransac(x, y, x_err, y_err, order, trials=200, cut=3.0, seed=None):
+    # RANSAC: every stacked fit tries `trials` random minimal sets of order+1 points at once and keeps the
+    # curve with the most points within cut sigma (fewest chi2 among those on ties). Points outside are
+    # flagged as outliers, returns the same as fit_huber
+    x, y, x_err, y_err = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (x, y, x_err, y_err)))
+    rng = np.random.default_rng(seed)
+    valid = ~(np.isnan(x) | np.isnan(y) | np.isnan(x_err) | np.isnan(y_err))
+    shape = x.shape[:-1] + (trials, x.shape[-1])
+
+    # order+1 distinct valid points per trial: the smallest random keys, invalid points sort last
+    keys = np.where(valid[..., None, :], rng.random(shape), np.inf)
+    subset = np.argsort(keys, axis=-1)[..., :order + 1]
+    x_sub, y_sub = (np.take_along_axis(np.broadcast_to(a[..., None, :], shape), subset, axis=-1) for a in (x, y))
+    candidates = fit_polynomial(x_sub, y_sub, np.ones_like(x_sub), order)[0]
+
+    x_all, x_err_all, y_err_all = (a[..., None, :] for a in (x, x_err, y_err))
+    r = np.abs(y[..., None, :] - evaluate_polynomial(candidates, x_all)) / effective_sigma(candidates, x_all, x_err_all, y_err_all)
+    inliers = valid[..., None, :] & (r <= cut)
+    chi2 = np.sum(np.where(inliers, r, 0.0) ** 2, axis=-1)
+    score = np.where(np.isnan(candidates).any(axis=-1), -1.0, inliers.sum(axis=-1) + 1.0 / (1.0 + chi2))
+    best = np.argmax(score, axis=-1)[..., None, None]
+    found = np.take_along_axis(score, best[..., 0], axis=-1) >= 0
+    best_inliers = np.take_along_axis(inliers, best, axis=-2)[..., 0, :]
+    return clean_fit(x, y, x_err, y_err, order, valid & ~best_inliers & found)
+
+def joint_design(x, angles, order, angle_order):
+    # Design of the joint calibration of all angles, x is (n_angles, n). Every angle has its own offset,
+    # the coefficient of x**k (k >= 1) is a polynomial of degree angle_order in the scaled angle and
+    # shared by all angles. Columns: n_angles offsets, then a[k, m] for k = order..1, m = 0..angle_order.
+    # Also returns the (n_angles, order+1, n_params) map from the joint parameters to the per angle
+    # polynomials (highest power first)
+    x = np.asarray(x, dtype=np.float64)
+    angles = np.asarray(angles, dtype=np.float64)
+    n_angles = len(angles)
+    span = np.ptp(angles) if n_angles > 1 and np.ptp(angles) > 0 else 1.0
+    t = (angles - angles.mean()) / span
+    t_powers = t[:, None] ** np.arange(angle_order + 1) # (n_angles, angle_order+1)
+
+    to_angle = np.zeros((n_angles, order + 1, n_angles + order * (angle_order + 1)))
+    to_angle[np.arange(n_angles), order, np.arange(n_angles)] = 1.0
+    for k in range(order, 0, -1):
+        start = n_angles + (order - k) * (angle_order + 1)
+        to_angle[:, order - k, start:start + angle_order + 1] = t_powers
+
+    # row of a point = its x powers pushed through the map of its angle
+    design = np.einsum('anj,ajp->anp', polynomial_design(x, order), to_angle)
+    return design, to_angle
+
+def fit_joint(x, y, x_err, y_err, order, angles, angle_order=2, max_iter=20, rtol=1e-10):
+    # One effective variance fit of all angles (x, y, errors as (n_angles, n)) with the model of
+    # joint_design. Returns the same as fit_effective_variance, one polynomial per angle with its
+    # covariance and the common chi2/ndf. Angles without any valid point come back as nan
+    x, y, x_err, y_err = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (x, y, x_err, y_err)))
+    design, to_angle = joint_design(x, angles, order, angle_order)
+    flat_design = design.reshape(-1, design.shape[-1])
+
+    sigma = np.where(np.isnan(x_err) | np.isnan(y_err), np.nan, 1.0)
+    params = fit_linear(flat_design, y.ravel(), sigma.ravel())[0]
+    for _ in range(max_iter):
+        sigma = effective_sigma(to_angle @ params, x, x_err, y_err)
+        new_params, pcov, chi2_ndf = fit_linear(flat_design, y.ravel(), sigma.ravel())
+        step = np.abs(new_params - params)
+        params = new_params
+        if not (step > rtol * np.maximum(np.abs(params), 1.0)).any():
+            break
+
+    angle_params = to_angle @ params
+    angle_pcov = to_angle @ pcov @ np.swapaxes(to_angle, -1, -2)
+    empty = ~(~(np.isnan(x) | np.isnan(y) | np.isnan(x_err) | np.isnan(y_err))).any(axis=-1)
+    angle_params[empty] = np.nan
+    angle_pcov[empty] = np.nan
+    return angle_params, angle_pcov, np.full(len(angle_params), chi2_ndf), effective_sigma(angle_params, x, x_err, y_err)
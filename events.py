@@ -0,0 +1,64 @@
+import os
+from itertools import repeat
+import numpy as np
+from parallel import pool_map
+from spectra import SPECTRUM_AXIS
+
+# Event-by-event focal-plane data histogrammed into position spectra. Event files are .npy arrays
+# (1D positions, 2D with the position in the first column, or structured with a 'position' field,
+# otherwise the first one) or raw little-endian arrays of positions (EVENT_DTYPES). They are memory
+# mapped and read EVENT_CHUNK events at a time, so the memory needed does not grow with the file
+EVENT_DTYPES = {'.evt': '<f8', '.f64': '<f8', '.f32': '<f4', '.i32': '<i4', '.u16': '<u2', '.i16': '<i2'} # raw event files by extension
+EVENT_EXTENSIONS = ('.npy',) + tuple(EVENT_DTYPES)
+EVENT_CHUNK = 2 ** 22 # events read and histogrammed at a time
+HISTOGRAM_PREFIX = 'histogram_' # spectra written by histogram_angles are '<prefix><angle>deg.npy'
+
+def open_events(path):
+    # Memory mapped 1D array of the positions of an event file
+    extension = os.path.splitext(path)[1].lower()
+    if extension != '.npy':
+        return np.memmap(path, dtype=EVENT_DTYPES.get(extension, '<f8'), mode='r')
+    events = np.load(path, mmap_mode='r')
+    if events.dtype.names:
+        return events['position' if 'position' in events.dtype.names else events.dtype.names[0]]
+    return events if events.ndim == 1 else events[:, 0]
+
+def histogram_events(path, lo, hi, bins):
+    # Histogram of the positions in bins equal bins from lo to hi, positions outside (and nan) are dropped
+    events = open_events(path)
+    counts = np.zeros(bins, dtype=np.int64)
+    scale = bins / (hi - lo)
+    for first in range(0, len(events), EVENT_CHUNK):
+        positions = np.asarray(events[first:first + EVENT_CHUNK], dtype=np.float64)
+        positions = positions[(positions >= lo) & (positions < hi)]
+        # rounding can put a position just below hi into bin 'bins'
+        index = np.minimum(((positions - lo) * scale).astype(np.intp), bins - 1)
+        counts += np.bincount(index, minlength=bins)
+    return counts
+
+def histogram_files(files, lo, hi, bins, max_workers=None):
+    # {angle: [paths]} -> {angle: counts}, the runs of an angle are summed. The files are
+    # histogrammed in a process pool, one file per task
+    paths = [path for angle_paths in files.values() for path in angle_paths]
+    counts = pool_map(histogram_events, paths, repeat(lo, len(paths)), repeat(hi, len(paths)), repeat(bins, len(paths)), max_workers=max_workers)
+    spectra = {}
+    for angle, angle_paths in files.items():
+        spectra[angle] = np.sum(counts[:len(angle_paths)], axis=0)
+        counts = counts[len(angle_paths):]
+    return spectra
+
+def histogram_angles(files, lo, hi, bins, directory):
+    # Histograms the event files of every angle ({angle: [paths]}) and writes the spectra to
+    # directory (created if needed) as .npy files for the spectrum fits and peak search, each with
+    # an axis file so their channels are the positions of the bin centres. Returns the file pattern
+    # of the spectra and {angle: (number of files, counts)}
+    spectra = histogram_files(files, lo, hi, bins)
+    os.makedirs(directory, exist_ok=True)
+    pattern = os.path.join(directory, HISTOGRAM_PREFIX + '{angle}deg.npy')
+    width = (hi - lo) / bins
+    for angle, counts in spectra.items():
+        path = pattern.format(angle=angle)
+        np.save(path, counts)
+        with open(os.path.splitext(path)[0] + SPECTRUM_AXIS, 'w', encoding='utf-8') as f:
+            f.write(f"{lo + width / 2!r} {width!r}\n")
+    return pattern, {angle: (len(files[angle]), spectra[angle]) for angle in spectra}
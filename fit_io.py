@@ -0,0 +1,284 @@
+import os
+import re
+import glob
+import hashlib
+import tempfile
+import xml.etree.ElementTree as ET
+import numpy as np
+from parallel import pool_map
+
+# Peak quantities written by HDTV for every <peak>, in the same order as the
+# angle tab columns (Position, Uncertainty, Width, Uncertainty, Volume, Uncertainty)
+FIT_FIELDS = ('pos', 'pos_err', 'width', 'width_err', 'vol', 'vol_err')
+FIT_DTYPE = np.dtype([(field, np.float64) for field in FIT_FIELDS])
+FIT_COLUMN = {
+    ('pos', 'value'): 0, ('pos', 'error'): 1,
+    ('width', 'value'): 2, ('width', 'error'): 3,
+    ('vol', 'value'): 4, ('vol', 'error'): 5,
+}
+ANGLE_PATTERN = r'(\d+)\s*_?deg' # the number taken as the angle of a file name when it has one
+
+def parse_fit_file(file):
+    # Single pass over an HDTV .fit/.xml file, returns the uncalibrated and calibrated
+    # peak parameters as structured arrays (FIT_DTYPE) in file order at full precision
+    uncal_rows = []
+    cal_rows = []
+    stack = []
+    peak = None
+    for event, elem in ET.iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem.tag)
+            if elem.tag == 'peak':
+                peak = {'uncal': [np.nan] * len(FIT_FIELDS), 'cal': [np.nan] * len(FIT_FIELDS)}
+            continue
+
+        stack.pop()
+        if peak is None:
+            continue
+        if elem.tag in ('value', 'error') and len(stack) >= 3 and stack[-3] == 'peak':
+            column = FIT_COLUMN.get((stack[-1], elem.tag))
+            if column is not None and stack[-2] in peak and elem.text is not None:
+                peak[stack[-2]][column] = float(elem.text)
+        elif elem.tag == 'peak':
+            uncal_rows.append(tuple(peak['uncal']))
+            cal_rows.append(tuple(peak['cal']))
+            peak = None
+            elem.clear()
+
+    uncal = np.array(uncal_rows, dtype=FIT_DTYPE)
+    cal = np.array(cal_rows, dtype=FIT_DTYPE)
+    cal['width'] = np.abs(cal['width'])
+    return uncal, cal
+
+def read_fit_file(file):
+    # Picks the calibrated peaks if HDTV had a calibration loaded, otherwise the raw channels.
+    # Uncalibrated peaks are sorted by descending position, calibrated ones by ascending energy
+    uncal, cal = parse_fit_file(file)
+    cal_flag = len(cal) > 0 and not np.isnan(cal['pos'][0]) and cal['pos'][0] != uncal['pos'][0]
+    if cal_flag:
+        peaks = cal[np.argsort(cal['pos'], kind='stable')]
+    else:
+        peaks = uncal[np.argsort(-uncal['pos'], kind='stable')]
+    return peaks, cal_flag
+
+def fit_to_table(peaks):
+    # Lays the peaks out as angle tab rows: Use, Energy and its uncertainty are left empty (nan)
+    rows = np.full((len(peaks), 3 + len(FIT_FIELDS)), np.nan)
+    for j, field in enumerate(FIT_FIELDS):
+        rows[:, 3 + j] = peaks[field]
+    return rows
+
+def angle_candidates(path, angles, pattern=ANGLE_PATTERN):
+    # Angle tabs a file name may belong to: the number matched by pattern ('Run042_25deg.fit' -> 25)
+    # if there is one, otherwise every number in the name that is one of the angle tabs
+    stem = os.path.splitext(os.path.basename(path))[0]
+    marked = {int(token) for token in re.findall(pattern, stem, flags=re.IGNORECASE)}
+    return (marked or {int(token) for token in re.findall(r'\d+', stem)}) & set(angles)
+
+def angle_from_filename(path, angles, pattern=ANGLE_PATTERN):
+    # The angle of a file name (see angle_candidates), None if there is no match or it is ambiguous
+    found = angle_candidates(path, angles, pattern)
+    if len(found) == 1:
+        return found.pop()
+    return None
+
+def find_angle_runs(source, angles, extensions=('.fit', '.xml'), skipped=None):
+    # source is either a directory (searched for files with one of the extensions), a pattern
+    # with an {angle} field ('run_{angle}deg.fit', which may hold glob wildcards for several runs)
+    # or a glob pattern ('run_*deg.fit'). Returns {angle: [paths]} for every angle found. Files
+    # that were left out are appended to skipped (if given) as (path, reason)
+    if '{angle}' in source:
+        found = {angle: sorted(glob.glob(source.format(angle=angle))) for angle in angles}
+        return {angle: paths for angle, paths in found.items() if paths}
+
+    if os.path.isdir(source):
+        paths = [path for extension in extensions for path in glob.glob(os.path.join(source, '*' + extension))]
+    else:
+        paths = glob.glob(source)
+
+    files = {}
+    for path in sorted(paths):
+        found = angle_candidates(path, angles)
+        if len(found) == 1:
+            files.setdefault(found.pop(), []).append(path)
+        elif skipped is not None:
+            skipped.append((path, f"ambiguous angle ({', '.join(map(str, sorted(found)))})" if found else "no angle tab in the name"))
+    return dict(sorted(files.items()))
+
+def find_angle_files(source, angles, extensions=('.fit', '.xml'), skipped=None):
+    # Same as find_angle_runs, but one file per angle: {angle: path}, the first one by name
+    files = {}
+    for angle, paths in find_angle_runs(source, angles, extensions, skipped).items():
+        files[angle] = paths[0]
+        if skipped is not None:
+            skipped.extend((path, f"{paths[0]} is already used for {angle}-deg") for path in paths[1:])
+    return files
+
+def try_read_fit_file(path):
+    # read_fit_file that returns the error of a malformed, half-written or missing file instead of
+    # raising it, so one bad file does not lose the others read with it
+    try:
+        return read_fit_file(path)
+    except (ET.ParseError, OSError) as e:
+        return e
+
+def read_fit_files(paths, max_workers=None):
+    # Parses several fit files at once in a process pool, results are in the order of paths and
+    # are the error (see try_read_fit_file) for the files that could not be read
+    return pool_map(try_read_fit_file, paths, max_workers=max_workers)
+
+def match_fit_rows(old, new, tolerance=1.0):
+    # Pairs table rows (old) with peaks (new) by position: each peak takes the closest unclaimed row
+    # within that row's width (at least tolerance channels). Returns the (new index, old index) pairs
+    pairs = []
+    if len(old) and len(new):
+        dist = np.abs(new[:, 3][:, None] - old[:, 3][None, :])
+        limit = np.fmax(np.abs(old[:, 5]), tolerance)
+        dist[~(dist <= limit[None, :])] = np.inf
+        new_used = np.zeros(len(new), dtype=bool)
+        old_used = np.zeros(len(old), dtype=bool)
+        for flat in np.argsort(dist, axis=None, kind='stable'):
+            i, j = divmod(int(flat), len(old))
+            if not np.isfinite(dist[i, j]):
+                break
+            if new_used[i] or old_used[j]:
+                continue
+            pairs.append((i, j))
+            new_used[i] = old_used[j] = True
+    return pairs
+
+def merge_fit_rows(old, new, tolerance=1.0):
+    # Carries the Use/Energy/Uncertainty columns of the current table rows over to a refitted
+    # set of peaks (see match_fit_rows). Rows without a position are kept at the end as they are
+    merged = new.copy()
+    manual = old[np.isnan(old[:, 3])]
+    old = old[~np.isnan(old[:, 3])]
+    for i, j in match_fit_rows(old, new, tolerance):
+        merged[i, :3] = old[j, :3]
+    return np.vstack([merged, manual[:, :merged.shape[1]]])
+
+def add_fit_rows(old, new, tolerance=1.0):
+    # Appends the peaks that no table row has yet (see match_fit_rows), every existing row is kept
+    # as it is
+    with_position = np.nonzero(~np.isnan(old[:, 3]))[0]
+    found = np.zeros(len(new), dtype=bool)
+    for i, _ in match_fit_rows(old[with_position], new, tolerance):
+        found[i] = True
+    return np.vstack([old, new[~found][:, :old.shape[1]]])
+
+class FitWatcher:
+    # Polls a directory or file pattern (see find_angle_files) and reports the angles whose
+    # fit file is new or has a different mtime/size since the last poll
+    def __init__(self, source, angles):
+        self.source = source
+        self.angles = angles
+        self.seen = {}
+
+    def poll(self):
+        changed = {}
+        for angle, path in find_angle_files(self.source, self.angles).items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature = (path, stat.st_mtime_ns, stat.st_size)
+            if self.seen.get(angle) != signature:
+                self.seen[angle] = signature
+                changed[angle] = path
+        return changed
+
+    def forget(self, angles):
+        # Makes the next poll report these angles again, e.g. after HDTV was caught mid-write
+        for angle in angles:
+            self.seen.pop(angle, None)
+
+FIT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'SPSGui', 'fits')
+FIT_CACHE_SIZE = 256 * 1024 * 1024 # bytes kept on disk before the least recently used entries go
+
+class FitCache:
+    # Parsed fit files stored as compressed .npz, one per (absolute path, mtime, content hash).
+    # Entry mtimes are bumped on every hit so eviction drops the least recently used ones first
+    def __init__(self, cache_dir=FIT_CACHE_DIR, max_bytes=FIT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, path):
+        path = os.path.abspath(path)
+        with open(path, 'rb') as f:
+            content_hash = hashlib.sha1(f.read()).hexdigest()
+        key = f"{path}\0{os.stat(path).st_mtime_ns}\0{content_hash}"
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        entry = self.entry(key)
+        try:
+            with np.load(entry) as npz:
+                result = npz['peaks'], bool(npz['cal_flag'])
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(entry)
+        self.hits += 1
+        return result
+
+    def put(self, key, peaks, cal_flag):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, peaks=peaks, cal_flag=cal_flag)
+        os.replace(tmp, self.entry(key))
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    def read(self, path):
+        result = self.read_many([path])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def read_many(self, paths, max_workers=None):
+        # Same as read_fit_files, but only files that are not cached get parsed. Files that cannot
+        # be read give their error in place of the result and are not cached
+        paths = list(paths)
+        results = []
+        keys = []
+        for path in paths:
+            try:
+                keys.append(self.key(path))
+                results.append(self.get(keys[-1]))
+            except OSError as e:
+                keys.append(None)
+                results.append(e)
+        missing = [i for i, result in enumerate(results) if result is None]
+        parsed = read_fit_files([paths[i] for i in missing], max_workers)
+        for i, result in zip(missing, parsed):
+            if not isinstance(result, Exception):
+                self.put(keys[i], *result)
+            results[i] = result
+        return results
+
+    def stats(self):
+        entries = self.entries()
+        size = sum(size for _, size, _ in entries) / (1024 * 1024)
+        return f"Fit cache: {self.hits} hit(s), {self.misses} miss(es), {len(entries)} file(s) ({size:.1f} MB)"
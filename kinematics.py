@@ -0,0 +1,123 @@
+from functools import lru_cache
+import numpy as np
+
+# Relativistic two-body kinematics a + A -> b + B*, b is the ejectile seen in the focal plane.
+# Masses are atomic masses in u given as (beam, target, ejectile, residual), energies in MeV and
+# angles in degrees. Everything broadcasts, e.g. excitation energies (states, 1) against lab
+# angles (angles,) give (states, angles) arrays
+AMU_MEV = 931.49410242 # MeV/c^2 per u
+KINEMATICS_CACHE_SIZE = 64 # (reaction, beam energy, states, angles) tables kept by kinematics_table
+
+def parse_masses(text):
+    # 'a, A, b, B' (or whitespace separated) in u -> tuple of 4 floats
+    masses = tuple(float(field) for field in text.replace(',', ' ').split())
+    if len(masses) != 4:
+        raise ValueError("four masses are needed: beam, target, ejectile, residual")
+    return masses
+
+def two_body(masses, beam_energy, excitation, theta_lab):
+    # Returns a dict of arrays: ejectile kinetic energy 'energy' [MeV] and momentum 'momentum' [MeV/c],
+    # 'theta_cm' [deg] and 'jacobian' = dOmega_lab/dOmega_cm (sigma_cm = sigma_lab * jacobian).
+    # Where two ejectile energies exist at one lab angle the faster one is taken, states that
+    # cannot be reached at all are nan
+    m_a, m_A, m_b, m_B = (m * AMU_MEV for m in masses)
+    m_B = m_B + np.asarray(excitation, dtype=np.float64)
+    theta = np.radians(np.asarray(theta_lab, dtype=np.float64))
+
+    E_a = beam_energy + m_a
+    p_a = np.sqrt(E_a ** 2 - m_a ** 2)
+    s = m_a ** 2 + m_A ** 2 + 2 * E_a * m_A
+    sqrt_s = np.sqrt(s)
+    beta = p_a / (E_a + m_A)
+    gamma = (E_a + m_A) / sqrt_s
+
+    # ejectile momentum and energy in the CM frame
+    with np.errstate(invalid='ignore'):
+        p_cm = np.sqrt((s - (m_b + m_B) ** 2) * (s - (m_b - m_B) ** 2)) / (2 * sqrt_s)
+    E_cm = np.sqrt(p_cm ** 2 + m_b ** 2)
+
+    # cos(theta_cm) from tan(theta_lab) = sin(theta_cm) / (gamma (cos(theta_cm) + g))
+    g = beta * E_cm / p_cm
+    cos_lab, sin_lab = np.cos(theta), np.sin(theta)
+    a = cos_lab ** 2 + gamma ** 2 * sin_lab ** 2
+    b = gamma ** 2 * sin_lab ** 2 * g
+    with np.errstate(invalid='ignore'):
+        root = cos_lab * np.sqrt(cos_lab ** 2 + gamma ** 2 * sin_lab ** 2 * (1 - g ** 2))
+    x = (-b + root) / a
+    # only the root on the same side as the lab angle is a solution
+    x = np.where((x + g) * cos_lab >= 0, x, (-b - root) / a)
+    x = np.clip(x, -1.0, 1.0)
+
+    E_lab = gamma * (E_cm + beta * p_cm * x)
+    p_lab = np.sqrt(np.maximum(E_lab ** 2 - m_b ** 2, 0.0))
+    jacobian = gamma * p_cm * (p_lab - beta * E_lab * cos_lab) / p_lab ** 2
+    return {
+        'energy': E_lab - m_b,
+        'momentum': p_lab,
+        'theta_cm': np.degrees(np.arccos(x)),
+        'jacobian': jacobian,
+    }
+
+@lru_cache(maxsize=KINEMATICS_CACHE_SIZE)
+def kinematics_table(masses, beam_energy, excitation, theta_lab):
+    # two_body for every (state, angle) pair, cached per reaction, beam energy, states and angles.
+    # excitation and theta_lab are tuples, the arrays are (states, angles) and read-only
+    table = two_body(masses, beam_energy, np.array(excitation)[:, None], np.array(theta_lab)[None, :])
+    for array in table.values():
+        array.flags.writeable = False
+    return table
+
+TESLA_METER_PER_MEV = 1 / 299.792458 # B*rho [T m] of a momentum of 1 MeV/c with charge 1 e
+EXCITATION_GRID = (-1.0, 20.0, 4201) # MeV, range and points of the excitation grid of rigidity_table (5 keV steps)
+
+def rigidity(momentum, charge):
+    # Magnetic rigidity B*rho [T m] of a momentum [MeV/c] with charge [e]
+    return np.asarray(momentum, dtype=np.float64) * TESLA_METER_PER_MEV / charge
+
+def two_body_in_target(masses, beam_energy, excitation, theta_lab, target=None):
+    # two_body for a reaction in the middle of the target. target is (thickness [mg/cm^2], beam
+    # StoppingTable, ejectile StoppingTable) for a target normal to the beam: the beam loses energy in
+    # half the thickness, the ejectile in half the thickness over |cos(theta_lab)|. 'energy' and
+    # 'momentum' are then those of the ejectile leaving the target and 'energy_loss' is what it lost
+    if target is None:
+        return two_body(masses, beam_energy, excitation, theta_lab)
+    thickness, beam_table, ejectile_table = target
+    table = two_body(masses, float(beam_table.energy_after(beam_energy, thickness / 2)), excitation, theta_lab)
+    path = thickness / 2 / np.abs(np.cos(np.radians(np.asarray(theta_lab, dtype=np.float64))))
+    energy = np.where(np.isnan(table['energy']), np.nan, ejectile_table.energy_after(table['energy'], path))
+    m_b = masses[2] * AMU_MEV
+    table['energy_loss'] = table['energy'] - energy
+    table['energy'] = energy
+    table['momentum'] = np.sqrt(energy ** 2 + 2 * energy * m_b)
+    return table
+
+def rigidity_derivative(masses, beam_energy, charge, excitation, theta_lab, step=1e-3, target=None):
+    # d(B*rho)/d(excitation) [T m/MeV] by a central difference, broadcasts like two_body
+    excitation = np.asarray(excitation, dtype=np.float64)
+    high = two_body_in_target(masses, beam_energy, excitation + step, theta_lab, target)['momentum']
+    low = two_body_in_target(masses, beam_energy, excitation - step, theta_lab, target)['momentum']
+    return rigidity(high - low, charge) / (2 * step)
+
+@lru_cache(maxsize=KINEMATICS_CACHE_SIZE)
+def rigidity_table(masses, beam_energy, charge, theta_lab, grid=EXCITATION_GRID, target=None):
+    # B*rho on the excitation grid for every lab angle (tuple), cached per reaction, beam energy,
+    # charge and target. Returns the grid (n,) and the (angles, n) rigidities, nan above the reaction
+    # threshold (or where the ejectile stops in the target)
+    excitation = np.linspace(*grid)
+    brho = rigidity(two_body_in_target(masses, beam_energy, excitation[None, :], np.array(theta_lab)[:, None], target)['momentum'], charge)
+    brho[~np.isfinite(brho) | (brho <= 0)] = np.nan
+    excitation.flags.writeable = False
+    brho.flags.writeable = False
+    return excitation, brho
+
+def excitation_from_rigidity(masses, beam_energy, charge, theta_lab, brho, grid=EXCITATION_GRID, target=None):
+    # Inverts B*rho (angles, n) to excitation energies [MeV] by interpolating rigidity_table of every
+    # angle, nan outside of the grid
+    excitation, table = rigidity_table(masses, beam_energy, charge, tuple(float(angle) for angle in theta_lab), grid, target)
+    brho = np.asarray(brho, dtype=np.float64)
+    result = np.full(brho.shape, np.nan)
+    for i, row in enumerate(table):
+        reachable = ~np.isnan(row)
+        # the rigidity falls with the excitation energy, np.interp needs it rising
+        result[i] = np.interp(brho[i], row[reachable][::-1], excitation[reachable][::-1], left=np.nan, right=np.nan)
+    return result
@@ -0,0 +1,118 @@
+import re
+import numpy as np
+
+# Reference level library for identifying the peaks of the angle tabs. Level files are plain text,
+# one level per line: energy [keV], optionally its uncertainty [keV] and a label (e.g. the spin),
+# separated by whitespace or commas. Lines starting with # are skipped
+
+class LevelLibrary:
+    # Levels sorted by energy, lookups go through np.searchsorted
+    def __init__(self, energies, errors=None, labels=None):
+        energies = np.asarray(energies, dtype=np.float64)
+        order = np.argsort(energies, kind='stable')
+        self.energies = energies[order]
+        self.errors = np.zeros(len(energies)) if errors is None else np.asarray(errors, dtype=np.float64)[order]
+        self.labels = [''] * len(energies) if labels is None else [labels[i] for i in order]
+
+    def __len__(self):
+        return len(self.energies)
+
+    def nearest(self, energies):
+        # Index of the closest level to every energy (any shape) and the distance to it, -1/inf for nan
+        energies = np.asarray(energies, dtype=np.float64)
+        if len(self.energies) == 0:
+            return np.full(energies.shape, -1), np.full(energies.shape, np.inf)
+        right = np.clip(np.searchsorted(self.energies, energies), 0, len(self.energies) - 1)
+        left = np.clip(right - 1, 0, len(self.energies) - 1)
+        take_left = np.abs(energies - self.energies[left]) < np.abs(energies - self.energies[right])
+        index = np.where(take_left, left, right)
+        distance = np.abs(energies - self.energies[index])
+        missing = np.isnan(energies)
+        return np.where(missing, -1, index), np.where(missing, np.inf, distance)
+
+def load_level_library(path):
+    energies, errors, labels = [], [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            fields = [field for field in re.split(r'[,\s]+', line) if field]
+            try:
+                energy = float(fields[0])
+            except ValueError:
+                continue # header line
+            error = 0.0
+            label = ' '.join(fields[1:])
+            if len(fields) > 1:
+                try:
+                    error = float(fields[1])
+                    label = ' '.join(fields[2:])
+                except ValueError:
+                    pass
+            energies.append(energy)
+            errors.append(error)
+            labels.append(label)
+    return LevelLibrary(energies, errors, labels)
+
+def best_calibration(positions, library, dispersions, tolerance, prior=None):
+    # Line E = slope * pos + offset that puts the most peaks within tolerance of a level, with the
+    # slope taken from the dispersions to try. Every (dispersion, peak, level) triple proposes an
+    # offset and the score of a proposal is the number of proposals of the same slope within
+    # tolerance of it (one sort and two searchsorted for all of them); ties go to the offset closest
+    # to the prior. Returns (slope, offset), nan if no peak can be matched
+    positions = positions[~np.isnan(positions)]
+    if len(positions) == 0 or len(library) == 0:
+        return np.nan, np.nan
+    dispersions = np.asarray(dispersions, dtype=np.float64)
+    offsets = library.energies[None, None, :] - dispersions[:, None, None] * positions[None, :, None]
+    offsets = offsets.reshape(len(dispersions), -1)
+
+    # rows of different slopes are moved apart so a single sorted array holds all of them
+    spread = np.ptp(offsets) + 4 * tolerance + 1.0
+    keys = offsets + spread * np.arange(len(dispersions))[:, None]
+    sorted_keys = np.sort(keys, axis=None)
+    keys = keys.ravel()
+    votes = np.searchsorted(sorted_keys, keys + tolerance, side='right') - np.searchsorted(sorted_keys, keys - tolerance, side='left')
+
+    offsets = offsets.ravel()
+    if prior is None or np.isnan(prior):
+        closeness = np.zeros(len(offsets))
+    else:
+        closeness = 1.0 / (1.0 + np.abs(offsets - prior))
+    best = np.argmax(votes + closeness)
+    return dispersions[best // (len(positions) * len(library))], offsets[best]
+
+def identify_levels(positions, angles, library, dispersion, shift=0.0, tolerance=10.0, dispersion_range=0.05, steps=101, iterations=3):
+    # First guess of the peak energies of every angle, positions is (n_angles, n) with nan padding.
+    # dispersion [keV/channel] is the initial guess, slopes within +-dispersion_range of it are tried.
+    # Each angle gets its line from best_calibration, starting from the previous angle's offset moved
+    # by shift [keV/deg] (the kinematic shift between angles). The line of every angle is then refined
+    # on its nearest-level matches. Returns the (n_angles, n) predicted energies
+    positions = np.asarray(positions, dtype=np.float64)
+    angles = np.asarray(angles, dtype=np.float64)
+    dispersions = dispersion * (1.0 + np.linspace(-dispersion_range, dispersion_range, steps))
+    slopes = np.full(len(angles), np.nan)
+    offsets = np.full(len(angles), np.nan)
+    prior = None
+    for i, angle in enumerate(angles):
+        if i > 0 and not np.isnan(offsets[i - 1]):
+            prior = offsets[i - 1] + shift * (angle - angles[i - 1])
+        slopes[i], offsets[i] = best_calibration(positions[i], library, dispersions, tolerance, prior)
+
+    for _ in range(iterations):
+        predicted = slopes[:, None] * positions + offsets[:, None]
+        index, distance = library.nearest(predicted)
+        matched = distance <= tolerance
+        # least squares line through the matched (position, level) pairs of every angle at once
+        count = matched.sum(axis=1)
+        x = np.where(matched, positions, 0.0)
+        y = np.where(matched, library.energies[np.maximum(index, 0)], 0.0)
+        mean_x = x.sum(axis=1) / np.maximum(count, 1)
+        mean_y = y.sum(axis=1) / np.maximum(count, 1)
+        sxx = np.sum(np.where(matched, (positions - mean_x[:, None]) ** 2, 0.0), axis=1)
+        sxy = np.sum(np.where(matched, (positions - mean_x[:, None]) * (y - mean_y[:, None]), 0.0), axis=1)
+        refine = (count >= 2) & (sxx > 0)
+        slopes = np.where(refine, sxy / np.where(refine, sxx, 1.0), slopes)
+        offsets = np.where(count >= 1, mean_y - slopes * mean_x, offsets)
+    return slopes[:, None] * positions + offsets[:, None]
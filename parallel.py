@@ -0,0 +1,12 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+def pool_map(function, *iterables, max_workers=None):
+    # list(map(function, *iterables)) with every call a task in a process pool of at most max_workers
+    # (default one per CPU) processes. With a single task or worker everything runs in this process
+    args = [list(iterable) for iterable in iterables]
+    workers = min(min(map(len, args)), max_workers or os.cpu_count() or 1)
+    if workers < 2:
+        return list(map(function, *args))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, *args))
@@ -0,0 +1,233 @@
+import os
+import glob
+import time
+import json
+import queue
+import struct
+import threading
+import tempfile
+import numpy as np
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+# Binary session layout (.sps):
+#   8 byte magic, little endian uint64 header length, JSON header, then one float64 block per tab.
+# Blocks are stored column by column (each table column is contiguous) and aligned to
+# SESSION_ALIGN bytes, so a tab can be memory mapped on its own without reading the rest.
+SESSION_MAGIC = b'SPSSESS1'
+SESSION_VERSION = 1
+SESSION_ALIGN = 64
+
+def aligned_offset(offset):
+    return -(-offset // SESSION_ALIGN) * SESSION_ALIGN
+
+def write_session(path, tabs):
+    # tabs maps tab index -> {'data': 2D float array, 'lineedits': {name: text}, 'comboboxes': {name: text}}
+    # A tab may instead give 'source': (session path, header) to have its table copied out of
+    # another session file here, e.g. by the journal writer thread instead of the GUI thread
+    entries = {}
+    blocks = []
+    offset = 0
+    for index, tab in tabs.items():
+        entry = {'lineedits': tab.get('lineedits', {}), 'comboboxes': tab.get('comboboxes', {})}
+        data = tab.get('data')
+        if data is None and 'source' in tab:
+            data = read_session_tab(*tab['source'], index)
+        if data is not None:
+            block = np.ascontiguousarray(np.asarray(data, dtype='<f8').T)
+            entry.update(rows=block.shape[1], cols=block.shape[0], offset=offset)
+            blocks.append((offset, block))
+            offset = aligned_offset(offset + block.nbytes)
+        entries[str(index)] = entry
+
+    header = json.dumps({'version': SESSION_VERSION, 'tabs': entries}).encode('utf-8')
+    data_start = aligned_offset(len(SESSION_MAGIC) + 8 + len(header))
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SESSION_MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for block_offset, block in blocks:
+                f.seek(data_start + block_offset)
+                f.write(block.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def is_session_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(SESSION_MAGIC)) == SESSION_MAGIC
+
+def read_session_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(SESSION_MAGIC)) != SESSION_MAGIC:
+            raise ValueError(f"{path} is not an SPS session file")
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode('utf-8'))
+    header['data_start'] = aligned_offset(len(SESSION_MAGIC) + 8 + length)
+    header['tabs'] = {int(index): entry for index, entry in header['tabs'].items()}
+    return header
+
+def read_session_tab(path, header, index):
+    # Memory maps the table of one tab as a read-only (rows, cols) array, None if it has no table
+    entry = header['tabs'][index]
+    if 'offset' not in entry:
+        return None
+    if entry['rows'] == 0 or entry['cols'] == 0:
+        return np.empty((entry['rows'], entry['cols']))
+    block = np.memmap(path, dtype='<f8', mode='r', offset=header['data_start'] + entry['offset'],
+                      shape=(entry['cols'], entry['rows']))
+    return block.T
+
+JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'SPSGui', 'autosave')
+
+def try_lock(f):
+    # Non-blocking exclusive lock on an open file, held until it is closed (or the process ends).
+    # False if another process holds it
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+class SessionJournal:
+    # Append-only autosave: small JSON-line records of every change are written by a background
+    # thread to the journal, compact() folds them into the snapshot. Every running instance has its
+    # own autosave-<pid>-<start>.{lock,sps,journal} files and holds the lock file locked while it
+    # runs; files whose lock can be taken belong to a session that did not close cleanly and are
+    # claimed for recovery (their lock is kept so no other instance claims them too)
+    def __init__(self, directory=JOURNAL_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.orphans = [] # (base path, open lock file) of the claimed sessions
+        for lock_path in sorted(glob.glob(os.path.join(directory, 'autosave-*.lock'))):
+            try:
+                lock = open(lock_path, 'a')
+            except OSError:
+                continue
+            if try_lock(lock):
+                self.orphans.append((lock_path[:-len('.lock')], lock))
+            else:
+                lock.close()
+
+        base = os.path.join(directory, f"autosave-{os.getpid()}-{time.time_ns():x}")
+        self.lock_path = base + '.lock'
+        self.snapshot_path = base + '.sps'
+        self.journal_path = base + '.journal'
+        self.lock = open(self.lock_path, 'a')
+        try_lock(self.lock)
+
+        self.records = 0 # records written since the last compaction
+        self.error = None # last autosave failure, set by the writer thread for the GUI to show
+        self.broken = False # set once the journal cannot be written, nothing is queued after that
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def writer(self):
+        # Runs until close(), a failure is kept in error instead of ending the thread
+        try:
+            f = open(self.journal_path, 'a', encoding='utf-8')
+        except OSError as e:
+            f = None
+            self.fail(e)
+        while True:
+            batch = [self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get())
+            for item in batch:
+                if item is None:
+                    if f is not None:
+                        try:
+                            f.close()
+                        except OSError:
+                            pass
+                    return
+                if self.broken:
+                    continue # queued before the failure was seen, nothing more is written
+                if isinstance(item, tuple):
+                    try:
+                        write_session(self.snapshot_path, item[1])
+                    except Exception as e:
+                        # e.g. the session file of pending tabs was moved, the journal still holds
+                        # every change since the last snapshot so it is kept as it is
+                        self.error = f"Autosave snapshot failed, changes are still journaled: {e}"
+                        continue
+                try:
+                    if isinstance(item, tuple):
+                        # compaction: everything before this point is in the snapshot
+                        f.seek(0)
+                        f.truncate()
+                    else:
+                        f.write(json.dumps(item) + '\n')
+                    f.flush()
+                except Exception as e:
+                    self.fail(e)
+
+    def fail(self, error):
+        # The journal cannot be written (e.g. the disk is full), autosave stops here
+        self.error = f"Autosave stopped, could not write {self.journal_path}: {error}"
+        self.broken = True
+
+    def append(self, record):
+        if self.broken:
+            return
+        self.records += 1
+        self.queue.put(record)
+
+    def compact(self, tabs):
+        # tabs as for write_session, taken at the moment compact is called
+        if self.broken:
+            return
+        self.records = 0
+        self.queue.put(('compact', tabs))
+
+    def recoveries(self):
+        # (snapshot path or None, records to replay on top of it, mtime) of every claimed session
+        # that left something behind, the most recent first
+        found = []
+        for base, _ in self.orphans:
+            snapshot = base + '.sps' if os.path.exists(base + '.sps') else None
+            records = []
+            if os.path.exists(base + '.journal'):
+                with open(base + '.journal', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            break # last record was cut off by the crash
+            if snapshot is not None or records:
+                mtime = max(os.path.getmtime(path) for path in (base + '.sps', base + '.journal') if os.path.exists(path))
+                found.append((snapshot, records, mtime))
+        return sorted(found, key=lambda item: -item[2])
+
+    def discard_recovery(self):
+        for base, lock in self.orphans:
+            for path in (base + '.sps', base + '.journal'):
+                if os.path.exists(path):
+                    os.remove(path)
+            lock.close()
+            os.remove(base + '.lock')
+        self.orphans = []
+
+    def close(self):
+        # Clean shutdown, nothing is left to recover
+        self.queue.put(None)
+        self.thread.join()
+        for path in (self.snapshot_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.lock.close()
+        os.remove(self.lock_path)
+        # sessions claimed but not recovered stay on disk for the next start
+        for _, lock in self.orphans:
+            lock.close()
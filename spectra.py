@@ -0,0 +1,258 @@
+import os
+import math
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.ndimage import correlate1d
+from parallel import pool_map
+
+# Raw focal-plane spectra and their peak fits, in place of fitting in HDTV and importing the .fit
+# files. Text spectra hold one count per line (channel = line number from 0) or channel and count
+# columns, binary spectra are 1D .npy arrays or raw arrays without a header (SPECTRUM_DTYPES).
+# The channel axis of a binary spectrum is its array index, unless a text file with the same name
+# and SPECTRUM_AXIS as extension gives the channel of the first bin and the bin width.
+# Widths are FWHM and volumes are peak areas in counts, as in the HDTV fit files
+SPECTRUM_AXIS = '.axis'
+SPECTRUM_DTYPES = {'.u32': '<u4', '.i32': '<i4', '.u64': '<u8', '.f32': '<f4', '.f64': '<f8', '.bin': '<u4'} # raw histograms by extension
+SPECTRUM_EXTENSIONS = ('.txt', '.dat', '.asc', '.npy') + tuple(SPECTRUM_DTYPES)
+SPECTRUM_POINTS = 4000 # bins a view is rebinned to at most, about the width of a plot in pixels
+FWHM_PER_SIGMA = 2 * np.sqrt(2 * np.log(2))
+PEAK_WIDTH = 5.0 # channels, FWHM guess for peaks that have no width in the table yet
+REGION_WIDTHS = 3.0 # a fit region reaches this many FWHM beyond its outermost peaks, closer peaks share a region
+SEARCH_SIGMA = PEAK_WIDTH / FWHM_PER_SIGMA # channels, width of the Gaussian the peak search smooths with, best near that of the peaks
+SEARCH_THRESHOLD = 5.0 # standard deviations the smoothed second derivative needs for a peak candidate
+SEARCH_CHUNK = 2 ** 20 # channels of all spectra searched at once, bounds the memory of the search
+SEARCH_HALO = 512 # channels read beyond each end of a chunk so peaks at its edges keep their shape
+
+class Spectrum:
+    # One histogram on an evenly spaced channel axis (start, step). Binary files are memory mapped
+    # and only the channels asked for are read from disk, text spectra are read in full
+    def __init__(self, path):
+        self.path = path
+        extension = os.path.splitext(path)[1].lower()
+        self.start, self.step = 0.0, 1.0
+        if extension in ('.npy',) + tuple(SPECTRUM_DTYPES):
+            if extension == '.npy':
+                self.counts = np.load(path, mmap_mode='r').reshape(-1)
+            else:
+                self.counts = np.memmap(path, dtype=SPECTRUM_DTYPES[extension], mode='r')
+            axis_path = os.path.splitext(path)[0] + SPECTRUM_AXIS
+            if os.path.exists(axis_path):
+                with open(axis_path, encoding='utf-8') as f:
+                    self.start, self.step = (float(field) for field in f.read().split()[:2])
+        else:
+            data = np.loadtxt(path, ndmin=2, comments='#')
+            self.counts = data[:, -1]
+            if data.shape[1] > 1 and len(data) > 1:
+                self.start, self.step = data[0, 0], (data[-1, 0] - data[0, 0]) / (len(data) - 1)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def index(self, channel):
+        # Array index of the channel value, not clipped
+        return (np.asarray(channel, dtype=np.float64) - self.start) / self.step
+
+    def bounds(self, lo=None, hi=None):
+        # Index range [first, last) of the channels from lo to hi (the whole spectrum if None)
+        first = 0 if lo is None else max(0, math.ceil(float(self.index(lo))))
+        last = len(self) if hi is None else min(len(self), math.floor(float(self.index(hi))) + 1)
+        return first, max(first, last)
+
+    def read(self, lo=None, hi=None):
+        # (channels, counts) from lo to hi as float64 arrays
+        first, last = self.bounds(lo, hi)
+        return self.start + self.step * np.arange(first, last), np.asarray(self.counts[first:last], dtype=np.float64)
+
+    def rebinned(self, lo=None, hi=None, factor=1):
+        # (channels, counts) from lo to hi with factor channels summed into one bin, the channel of a
+        # bin is the mean of its channels and the last bin may be narrower
+        first, last = self.bounds(lo, hi)
+        if factor <= 1 or last - first == 0:
+            return self.read(lo, hi)
+        edges = np.arange(first, last, factor)
+        counts = np.add.reduceat(self.counts[first:last], edges - first, dtype=np.float64)
+        middle = (edges + np.minimum(edges + factor, last) - 1) / 2
+        return self.start + self.step * middle, counts
+
+    def view(self, lo=None, hi=None, points=SPECTRUM_POINTS):
+        # rebinned to at most points bins, e.g. for plotting a zoom window of a large spectrum
+        first, last = self.bounds(lo, hi)
+        return self.rebinned(lo, hi, max(1, -(-(last - first) // points)))
+
+def peak_model(x, params):
+    # Linear background plus Gaussians, params = (offset, slope, then amplitude, centroid, sigma of
+    # every peak). Returns the model at x and its (len(x), len(params)) Jacobian
+    amplitude, centroid, sigma = params[2:].reshape(-1, 3).T
+    z = (x[:, None] - centroid) / sigma
+    gauss = np.exp(-z ** 2 / 2)
+    jac = np.empty((len(x), len(params)))
+    jac[:, 0] = 1.0
+    jac[:, 1] = x
+    jac[:, 2::3] = gauss
+    jac[:, 3::3] = gauss * amplitude * z / sigma
+    jac[:, 4::3] = gauss * amplitude * z ** 2 / sigma
+    return params[0] + params[1] * x + gauss @ amplitude, jac
+
+def peak_regions(centroids, fwhms):
+    # Groups the peaks into fit regions: returns a list of (peak indices, lo, hi) with the peaks that
+    # lie within REGION_WIDTHS FWHM of a neighbour fitted together
+    order = np.argsort(centroids, kind='stable')
+    reach = REGION_WIDTHS * fwhms[order]
+    gaps = np.diff(centroids[order]) > np.maximum(reach[1:], reach[:-1])
+    regions = []
+    for group in np.split(order, np.nonzero(gaps)[0] + 1):
+        lo = np.min(centroids[group] - REGION_WIDTHS * fwhms[group])
+        hi = np.max(centroids[group] + REGION_WIDTHS * fwhms[group])
+        regions.append((group, lo, hi))
+    return regions
+
+def fit_region(x, counts, centroids, fwhms):
+    # Least squares fit of one region with Poisson weights (empty channels count as 1), the
+    # background is taken relative to the middle of the region. Returns the (peaks, 6) rows of
+    # position, FWHM and area with their uncertainties, nan if the region cannot be fitted
+    rows = np.full((len(centroids), 6), np.nan)
+    if len(x) <= 3 * len(centroids) + 2:
+        return rows
+    center = (x[0] + x[-1]) / 2
+    x = x - center
+    weights = 1.0 / np.sqrt(np.maximum(counts, 1.0))
+
+    # starting point: background line through the region edges, peak heights above it
+    edge = max(1, len(x) // 10)
+    left, right = counts[:edge].mean(), counts[-edge:].mean()
+    slope = (right - left) / (x[-1] - x[0]) if x[-1] != x[0] else 0.0
+    offset = (left + right) / 2
+    mu = centroids - center
+    sigma = fwhms / FWHM_PER_SIGMA
+    nearest = np.clip(np.searchsorted(x, mu), 0, len(x) - 1)
+    height = np.maximum(counts[nearest] - offset - slope * mu, 1.0)
+    start = np.concatenate([[offset, slope], np.column_stack([height, mu, sigma]).ravel()])
+
+    step = np.min(np.diff(x)) if len(x) > 1 else 1.0
+    lower = np.concatenate([[-np.inf, -np.inf], np.tile([0.0, x[0], step / 4], len(mu))])
+    upper = np.concatenate([[np.inf, np.inf], np.tile([np.inf, x[-1], x[-1] - x[0]], len(mu))])
+    start = np.clip(start, lower, upper)
+
+    def residuals(params):
+        return (peak_model(x, params)[0] - counts) * weights
+
+    def jacobian(params):
+        return peak_model(x, params)[1] * weights[:, None]
+
+    try:
+        result = least_squares(residuals, start, jac=jacobian, bounds=(lower, upper), method='trf', x_scale='jac')
+    except (ValueError, np.linalg.LinAlgError):
+        return rows
+    pcov = np.linalg.pinv(result.jac.T @ result.jac)
+
+    amplitude, mu, sigma = result.x[2:].reshape(-1, 3).T
+    index = 2 + 3 * np.arange(len(mu))
+    var_amp, var_mu, var_sigma = pcov[index, index], pcov[index + 1, index + 1], pcov[index + 2, index + 2]
+    cov_amp_sigma = pcov[index, index + 2]
+    # area of a Gaussian in counts, channels may be wider than 1
+    channel = np.median(np.diff(x)) if len(x) > 1 else 1.0
+    area = np.sqrt(2 * np.pi) * amplitude * sigma / channel
+    area_var = 2 * np.pi * (sigma ** 2 * var_amp + amplitude ** 2 * var_sigma + 2 * amplitude * sigma * cov_amp_sigma) / channel ** 2
+    rows[:] = np.column_stack([mu + center, np.sqrt(var_mu), FWHM_PER_SIGMA * sigma, FWHM_PER_SIGMA * np.sqrt(var_sigma),
+                               area, np.sqrt(np.maximum(area_var, 0.0))])
+    return rows
+
+def fit_spectrum(path, centroids, fwhms):
+    # Fits the peaks at the given centroids [channel] of one spectrum file, nan FWHMs start from
+    # PEAK_WIDTH bins. Only the channels of the fit regions are read. The regions are laid out again from
+    # the fitted widths and refitted once, so a poor width guess does not cut off the tails. Returns
+    # (peaks, 6) rows in the order of the fit file columns (see FIT_FIELDS)
+    spectrum = Spectrum(path)
+    centroids = np.asarray(centroids, dtype=np.float64)
+    fwhms = np.where(np.isnan(fwhms), PEAK_WIDTH * abs(spectrum.step), np.abs(np.asarray(fwhms, dtype=np.float64)))
+    rows = np.full((len(centroids), 6), np.nan)
+    for _ in range(2):
+        for group, lo, hi in peak_regions(centroids, fwhms):
+            rows[group] = fit_region(*spectrum.read(lo, hi), centroids[group], fwhms[group])
+        fitted = ~np.isnan(rows[:, 0])
+        centroids = np.where(fitted, rows[:, 0], centroids)
+        fwhms = np.where(fitted, rows[:, 2], fwhms)
+    return rows
+
+def fit_spectra(paths, centroids, fwhms, max_workers=None):
+    # fit_spectrum of several spectra (one per angle) at once in a process pool, results are in the
+    # order of paths
+    return pool_map(fit_spectrum, paths, centroids, fwhms, max_workers=max_workers)
+
+def search_peaks(counts, sigma=SEARCH_SIGMA, threshold=SEARCH_THRESHOLD):
+    # Peak candidates of a (spectra, channels) block of counts, all spectra at once. The counts are
+    # correlated with minus the second derivative of a Gaussian of width sigma [channels], which is
+    # blind to a linear background; a candidate is a local maximum of it threshold standard deviations
+    # (Poisson) above 0. The maximum of a Gaussian peak of area A is A / (sqrt(2 pi) s^3) with s^2 =
+    # sigma^2 + sigma_peak^2, and its zero crossings lie at +-s. Returns the spectrum of every
+    # candidate and its (candidates, 6) rows (see FIT_FIELDS) with the position in array indices
+    counts = np.asarray(counts, dtype=np.float64)
+    half = int(np.ceil(4 * sigma))
+    t = np.arange(-half, half + 1)
+    kernel = (1 - t ** 2 / sigma ** 2) * np.exp(-t ** 2 / (2 * sigma ** 2)) / (np.sqrt(2 * np.pi) * sigma ** 3)
+    kernel -= kernel.mean()
+    response = correlate1d(counts, kernel, axis=-1, mode='nearest')
+    variance = correlate1d(np.maximum(counts, 1.0), kernel ** 2, axis=-1, mode='nearest')
+
+    middle = response[:, 1:-1]
+    found = np.zeros(response.shape, dtype=bool)
+    found[:, 1:-1] = (middle > response[:, :-2]) & (middle >= response[:, 2:]) & (middle ** 2 > threshold ** 2 * variance[:, 1:-1]) & (middle > 0)
+    spectrum, index = np.nonzero(found)
+
+    # vertex of the parabola through the maximum and its neighbours
+    left, peak, right = response[spectrum, index - 1], response[spectrum, index], response[spectrum, index + 1]
+    curvature = left - 2 * peak + right
+    shift = np.clip(np.where(curvature < 0, 0.5 * (left - right) / np.where(curvature < 0, curvature, -1.0), 0.0), -0.5, 0.5)
+    height = peak - 0.25 * (left - right) * shift
+
+    # first zero crossing of the response on either side, looked up in a window around every candidate
+    reach = min(SEARCH_HALO, 8 * half)
+    window = response[spectrum[:, None], np.clip(index[:, None] + np.arange(-reach, reach + 1), 0, response.shape[1] - 1)]
+    offsets = []
+    for side in (window[:, reach:], window[:, reach::-1]):
+        below = side <= 0
+        first = np.argmax(below, axis=1)
+        inside = below.any(axis=1)
+        before = np.take_along_axis(side, np.maximum(first - 1, 0)[:, None], axis=1)[:, 0]
+        after = np.take_along_axis(side, first[:, None], axis=1)[:, 0]
+        offsets.append(np.where(inside, first - 1 + before / (before - after), np.nan))
+    smoothed = (offsets[0] + offsets[1]) / 2
+    valid = ~np.isnan(smoothed)
+
+    width = np.sqrt(np.maximum(smoothed ** 2 - sigma ** 2, 0.25))
+    area = height * np.sqrt(2 * np.pi) * smoothed ** 3
+    significance = peak / np.sqrt(variance[spectrum, index])
+    rows = np.column_stack([index + shift, width / np.sqrt(area), FWHM_PER_SIGMA * width, FWHM_PER_SIGMA * width / np.sqrt(2 * area),
+                            area, area / significance])
+    keep = valid & (area > 0)
+    return spectrum[keep], rows[keep]
+
+def search_spectra(paths, sigma=SEARCH_SIGMA, threshold=SEARCH_THRESHOLD):
+    # search_peaks over whole spectrum files, all of them together, SEARCH_CHUNK channels at a time
+    # out of the memory mapped files. Candidates within the smoothing kernel of a spectrum end are
+    # dropped. Returns (candidates, 6) rows per path in channel units, by descending position like
+    # the uncalibrated fit files
+    spectra = [Spectrum(path) for path in paths]
+    lengths = np.array([len(spectrum) for spectrum in spectra])
+    edge = int(np.ceil(4 * sigma))
+    found = [[] for _ in spectra]
+    for first in range(0, int(lengths.max(initial=0)), SEARCH_CHUNK):
+        lo, hi = max(0, first - SEARCH_HALO), min(int(lengths.max()), first + SEARCH_CHUNK + SEARCH_HALO)
+        block = np.zeros((len(spectra), hi - lo))
+        for k, spectrum in enumerate(spectra):
+            part = spectrum.counts[lo:min(hi, len(spectrum))]
+            block[k, :len(part)] = part
+        which, rows = search_peaks(block, sigma, threshold)
+        index = rows[:, 0] + lo
+        keep = (index >= first) & (index < first + SEARCH_CHUNK) & (index >= edge) & (index < lengths[which] - edge)
+        rows[:, 0] = index
+        for k in range(len(spectra)):
+            found[k].append(rows[keep & (which == k)])
+
+    results = []
+    for spectrum, rows in zip(spectra, found):
+        rows = np.concatenate(rows) if rows else np.empty((0, 6))
+        rows[:, 0] = spectrum.start + spectrum.step * rows[:, 0]
+        rows[:, 1:4] *= abs(spectrum.step)
+        results.append(rows[np.argsort(-rows[:, 0], kind='stable')])
+    return results
@@ -0,0 +1,51 @@
+import re
+import numpy as np
+
+# Energy loss in the target from tabulated stopping powers. Tables are plain text with the energy
+# [MeV] in the first column and the total stopping power [MeV/(mg/cm^2)] in the second, e.g. the
+# two columns copied out of SRIM/LISE output; lines that do not start with two numbers are skipped
+
+class StoppingTable:
+    # Keeps the cumulative range R(E) = integral dE / S(E) on the table energies, so the energy left
+    # after any thickness is two np.interp calls: E_out = R^-1(R(E_in) - thickness). Energies above
+    # the last table energy are not extrapolated, they give nan
+    def __init__(self, energies, stopping):
+        energies = np.asarray(energies, dtype=np.float64)
+        stopping = np.asarray(stopping, dtype=np.float64)
+        order = np.argsort(energies, kind='stable')
+        self.energies = energies[order]
+        self.stopping = stopping[order]
+        inverse = 1.0 / self.stopping
+        # below the first table energy the stopping power is taken as constant
+        first = self.energies[0] * inverse[0]
+        self.ranges = first + np.concatenate([[0.0], np.cumsum(np.diff(self.energies) * (inverse[1:] + inverse[:-1]) / 2)])
+
+    @property
+    def max_energy(self):
+        return self.energies[-1]
+
+    def range(self, energy):
+        # mg/cm^2 an ion of this energy [MeV] travels before stopping, nan above the table
+        return np.interp(energy, np.concatenate([[0.0], self.energies]), np.concatenate([[0.0], self.ranges]), right=np.nan)
+
+    def energy_after(self, energy, thickness):
+        # Energy [MeV] left after thickness [mg/cm^2], 0 if the ion stops, nan above the table, broadcasts
+        remaining = self.range(energy) - np.asarray(thickness, dtype=np.float64)
+        left = np.interp(remaining, np.concatenate([[0.0], self.ranges]), np.concatenate([[0.0], self.energies]))
+        return np.where(np.isnan(remaining), np.nan, np.where(remaining > 0, left, 0.0))
+
+def load_stopping_table(path):
+    energies, stopping = [], []
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            fields = [field for field in re.split(r'[,\s]+', line.strip()) if field]
+            try:
+                energy, power = float(fields[0]), float(fields[1])
+            except (IndexError, ValueError):
+                continue
+            if energy > 0 and power > 0:
+                energies.append(energy)
+                stopping.append(power)
+    if len(energies) < 2:
+        raise ValueError(f"{path} has no stopping power table")
+    return StoppingTable(energies, stopping)